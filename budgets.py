@@ -0,0 +1,125 @@
+import re
+import time
+
+from db import app, db
+from models import User, Course, Assignment, Submission, Presentation, \
+    instructor_course_maps
+
+
+# Replays every page as a student, an instructor and an admin and compares
+# the SQL statement count of each against QUERY_BUDGETS /
+# QUERY_BUDGET_DEFAULT, and its wall time against ROUTE_TIME_BUDGET if that's
+# set. Meant to run against the synthetic dataset (manager.py seed_synthetic)
+# so that an N+1 pattern shows up as a blown budget.
+
+SQL_TIMING = re.compile(r'sql;dur=[\d.]+;desc="(\d+)"')
+
+# every other page has to answer 200; an error page is cheap, not fast
+EXPECTED_STATUS = {'get_course_syllabus': 302}
+
+
+def query_budget(endpoint):
+    return app.config['QUERY_BUDGETS'].get(
+        endpoint, app.config['QUERY_BUDGET_DEFAULT'])
+
+
+def _client(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = session['_user_id'] = unicode(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def _fixtures():
+    course = Course.query.order_by(Course.id).first()
+    instructor_id = db.session.query(instructor_course_maps.c.user_id).filter(
+        instructor_course_maps.c.course_id == course.id).first()[0]
+    submission = Submission.query.join(Assignment).filter(
+        Assignment.course_id == course.id,
+        Submission.is_official == True).order_by(Submission.id).first()
+    presentation = Presentation.query.filter(
+        Presentation.course_id == course.id).first()
+    admin = None
+    if app.config['ADMIN_USERNAMES']:
+        admin = User.query.filter(
+            User.username.in_(app.config['ADMIN_USERNAMES'])).first()
+    return {
+        'course': course.id,
+        'syllabus': course.syllabus_filename,
+        'assignment': submission.assignment_id,
+        'description': submission.assignment.description_filename,
+        'submission': submission.id,
+        'submission_file': submission.filename,
+        'presentation': presentation.id,
+        'presentation_file': presentation.filename,
+        'student': submission.user_id,
+        'instructor': instructor_id,
+        'admin': admin.id if admin else None,
+    }
+
+
+def _routes(f):
+    # (endpoint, roles, path); read-only pages only
+    return [
+        ('home', 'sia', '/'),
+        ('list_courses', 'sia', '/courses'),
+        ('view_course', 'sia', '/courses/%(course)d' % f),
+        ('get_course_syllabus', 'si', '/courses/%(course)d/syllabus' % f),
+        ('list_assignments', 'si', '/courses/%(course)d/assignments' % f),
+        ('export_gradebook', 'i', '/courses/%(course)d/gradebook.csv' % f),
+        ('new_assignment', 'i', '/courses/%(course)d/assignments/new' % f),
+        ('view_assignment', 'si', '/assignments/%(assignment)d' % f),
+        ('edit_assignment', 'i', '/assignments/%(assignment)d/edit' % f),
+        ('download_submissions', 'i',
+         '/assignments/%(assignment)d/submissions.zip' % f),
+        ('list_presentations', 'si', '/courses/%(course)d/presentations' % f),
+        ('new_presentation', 'i', '/courses/%(course)d/presentations/new' % f),
+        ('edit_presentation', 'i',
+         '/presentations/%(presentation)d/edit' % f),
+        ('new_course', 'a', '/courses/new'),
+        ('show_metrics', 'a', '/metrics'),
+        ('uploads.show', 'si', '/uploads/submissions/%(submission_file)s' % f),
+        ('uploads.show', 'si',
+         '/uploads/presentations/%(presentation_file)s' % f),
+        ('uploads.show', 'si', '/uploads/syllabi/%(syllabus)s' % f),
+        ('uploads.show', 'si', '/uploads/assignments/%(description)s' % f),
+    ]
+
+
+def run():
+    app.config['SERVER_TIMING'] = True
+    with app.app_context():
+        fixtures = _fixtures()
+    clients = {
+        's': _client(fixtures['student']),
+        'i': _client(fixtures['instructor']),
+    }
+    if fixtures['admin'] is not None:
+        clients['a'] = _client(fixtures['admin'])
+
+    results = []
+    for endpoint, roles, path in _routes(fixtures):
+        for role in roles:
+            if role not in clients:
+                continue
+            # a fresh app context, so nothing memoized on g carries over
+            # from the previous request when run inside manager.py
+            with app.app_context():
+                start = time.time()
+                response = clients[role].get(path)
+                response.get_data()  # drain streamed bodies too
+                seconds = time.time() - start
+            match = SQL_TIMING.search(response.headers.get('Server-Timing', ''))
+            queries = int(match.group(1)) if match else None
+            budget = query_budget(endpoint)
+            status = EXPECTED_STATUS.get(endpoint, 200)
+            time_budget = app.config['ROUTE_TIME_BUDGET']
+            ok = response.status_code == status and queries is not None and \
+                queries <= budget and \
+                (time_budget is None or seconds <= time_budget)
+            results.append({
+                'endpoint': endpoint, 'role': role, 'path': path,
+                'status': response.status_code, 'queries': queries,
+                'budget': budget, 'seconds': seconds, 'ok': ok})
+    return results
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import uuid
+
+from db import app, db
+from models import ChunkedUpload
+import storage
+
+
+# Large submissions can be sent as a sequence of fixed-size chunks appended
+# to a temp file under UPLOADS_CHUNK_DEST. A client that loses its connection
+# asks for the current offset and carries on from there. Each chunk can carry
+# its own checksum; the whole file is hashed once, when it's finished, since
+# the chunks of one upload may land on different workers.
+
+READ_SIZE = 64 * 1024
+
+
+class ChunkError(Exception):
+
+    def __init__(self, message, status=400):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def temp_path(upload):
+    return os.path.join(app.config['UPLOADS_CHUNK_DEST'], upload.id)
+
+
+def start(user, assignment, filename, size):
+    dest = app.config['UPLOADS_CHUNK_DEST']
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    upload = ChunkedUpload(
+        id=uuid.uuid4().hex,
+        user_id=user.id,
+        assignment_id=assignment.id,
+        filename=filename,
+        size=size,
+        received=0)
+    open(temp_path(upload), 'wb').close()
+    upload.save()
+    return upload
+
+
+def _file_hash(upload):
+    sha = hashlib.sha256()
+    with open(temp_path(upload), 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            sha.update(data)
+    return sha
+
+
+def append(upload, offset, stream, length, checksum=None):
+    if offset != upload.received:
+        raise ChunkError('expected offset %d' % upload.received, 409)
+    if length > app.config['UPLOADS_CHUNK_SIZE']:
+        raise ChunkError('chunk larger than %d bytes'
+                         % app.config['UPLOADS_CHUNK_SIZE'], 413)
+    if offset + length > upload.size:
+        raise ChunkError('chunk runs past the declared size', 416)
+
+    chunk_sha = hashlib.sha256()
+    written = 0
+    with open(temp_path(upload), 'r+b') as f:
+        f.seek(offset)
+        f.truncate()
+        while written < length:
+            data = stream.read(min(READ_SIZE, length - written))
+            if not data:
+                break
+            f.write(data)
+            chunk_sha.update(data)
+            written += len(data)
+        if written != length or (
+                checksum and checksum.lower() != chunk_sha.hexdigest()):
+            # drop the partial chunk so the client can resend it
+            f.truncate(offset)
+            raise ChunkError('chunk was incomplete or corrupt')
+        f.flush()
+        os.fsync(f.fileno())
+
+    upload.received = offset + length
+    upload.save()
+    return upload.received
+
+
+def finish(upload, upload_set):
+    if upload.received != upload.size:
+        raise ChunkError('expected %d more bytes'
+                         % (upload.size - upload.received), 409)
+    sha = _file_hash(upload)
+    # the caller commits the file together with the record that uses it
+    filename = storage.save_file(
+        upload_set, temp_path(upload), upload.filename,
+        sha.hexdigest(), upload.size)
+    db.session.delete(upload)
+    return filename
+
+
+def discard(upload):
+    try:
+        os.remove(temp_path(upload))
+    except OSError:
+        pass
+    db.session.delete(upload)
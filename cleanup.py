@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+
+from db import app, db
+from models import Course, Assignment, Presentation, Submission, \
+    ManifestEntry, ChunkedUpload, Blob, StoredFile, student_course_maps, \
+    instructor_course_maps
+import ingest
+import storage
+
+
+# Deleting a course, assignment or presentation removes everything under it
+# with a few bulk DELETEs in the caller's transaction, so nothing is loaded
+# row by row. Upload files are only released there; once the transaction has
+# committed, schedule_sweep() wakes a background thread in the worker that
+# removes the blobs nobody refers to any more. `manager.py sweep_uploads`
+# reconciles the upload directories against the filename columns, for files
+# a restarted worker never got to or that older versions left behind.
+
+FILENAME_COLUMNS = {
+    'submissions': Submission.filename,
+    'presentations': Presentation.filename,
+    'syllabi': Course.syllabus_filename,
+    'assignments': Assignment.description_filename,
+}
+
+log = logging.getLogger(__name__)
+
+_sweep = None
+_sweeper_pid = None
+_sweeper_lock = threading.Lock()
+
+
+def _delete(model, criterion):
+    db.session.execute(model.__table__.delete().where(criterion))
+
+
+def delete_assignments(criterion):
+    # `criterion` selects the assignments, e.g. Assignment.course_id == 1.
+    # Their rows are locked first, which waits out an ingest batch that is
+    # recording submissions for them (see ingest.drain).
+    db.session.query(Assignment.id).filter(criterion).with_for_update().all()
+    assignment_ids = db.select([Assignment.id]).where(criterion)
+    of_assignments = Submission.assignment_id.in_(assignment_ids)
+    _delete(ManifestEntry, ManifestEntry.submission_id.in_(
+        db.select([Submission.id]).where(of_assignments)))
+    storage.release_all('submissions', db.select(
+        [Submission.filename]).where(of_assignments))
+    _delete(Submission, of_assignments)
+    # their temp files are left to the sweep
+    _delete(ChunkedUpload, ChunkedUpload.assignment_id.in_(assignment_ids))
+    storage.release_all('assignments', db.select(
+        [Assignment.description_filename]).where(criterion))
+    _delete(Assignment, criterion)
+
+
+def delete_presentations(criterion):
+    storage.release_all('presentations', db.select(
+        [Presentation.filename]).where(criterion))
+    _delete(Presentation, criterion)
+
+
+def delete_course(course_id):
+    delete_assignments(Assignment.course_id == course_id)
+    delete_presentations(Presentation.course_id == course_id)
+    for table in (student_course_maps, instructor_course_maps):
+        db.session.execute(
+            table.delete().where(table.c.course_id == course_id))
+    storage.release_all('syllabi', db.select(
+        [Course.syllabus_filename]).where(Course.id == course_id))
+    _delete(Course, Course.id == course_id)
+
+
+def _sweep_forever(wake):
+    while True:
+        wake.wait()
+        wake.clear()
+        try:
+            with app.app_context():
+                storage.collect_garbage()
+                db.session.remove()
+        except Exception:
+            log.exception('Removing released uploads failed')
+
+
+def schedule_sweep():
+    # call once the deletion has committed
+    global _sweep, _sweeper_pid
+    with _sweeper_lock:
+        if _sweep is None or _sweeper_pid != os.getpid():
+            _sweep = threading.Event()
+            sweeper = threading.Thread(target=_sweep_forever, args=(_sweep,))
+            sweeper.daemon = True
+            sweeper.start()
+            _sweeper_pid = os.getpid()
+        _sweep.set()
+
+
+def unreferenced():
+    # [(setname, filename)] of stored files no filename column names
+    found = []
+    for setname, column in sorted(FILENAME_COLUMNS.items()):
+        found.extend((setname, filename) for filename, in db.session.query(
+            StoredFile.filename).filter(
+            StoredFile.setname == setname,
+            ~StoredFile.filename.in_(
+                db.select([column]).where(column != None))))
+    return found
+
+
+def _untouched_since(path, cutoff):
+    try:
+        return os.path.getmtime(path) < cutoff
+    except OSError:
+        return False  # already gone
+
+
+def _files(directory):
+    if not os.path.isdir(directory):
+        return []
+    return [(name, os.path.join(directory, name))
+            for name in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, name))]
+
+
+def orphaned_files(grace):
+    # paths in the upload directories that nothing refers to and that have
+    # been left alone for `grace` seconds, which covers uploads in flight
+    cutoff = time.time() - grace
+    orphans = []
+
+    blob_dest = app.config['UPLOADS_BLOB_DEST']
+    digests = set(digest for digest, in db.session.query(Blob.digest))
+    spooled = set(os.path.abspath(job['tmp']) for job in ingest.queued())
+    # temp files of uploads being received or waiting in the ingest queue
+    for name, path in _files(blob_dest):
+        if os.path.abspath(path) not in spooled:
+            orphans.append(path)
+    if os.path.isdir(blob_dest):
+        for prefix in sorted(os.listdir(blob_dest)):
+            if not os.path.isdir(os.path.join(blob_dest, prefix)):
+                continue
+            for name, path in _files(os.path.join(blob_dest, prefix)):
+                if prefix + name not in digests:
+                    orphans.append(path)
+
+    # files saved directly into the upload sets before blobs existed
+    for setname, column in sorted(FILENAME_COLUMNS.items()):
+        referenced = set(filename for filename, in db.session.query(
+            column).filter(column != None))
+        destination = app.upload_set_config[setname].destination
+        orphans.extend(path for name, path in _files(destination)
+                       if name not in referenced)
+
+    uploads = set(upload_id for upload_id, in db.session.query(
+        ChunkedUpload.id))
+    orphans.extend(path for name, path in _files(
+        app.config['UPLOADS_CHUNK_DEST']) if name not in uploads)
+
+    return [path for path in orphans if _untouched_since(path, cutoff)]
+
+
+def sweep(grace, dry_run=False):
+    # returns ([(setname, filename)] released, [path] removed)
+    released = unreferenced()
+    orphans = orphaned_files(grace)
+    if dry_run:
+        return released, orphans
+    for setname in FILENAME_COLUMNS:
+        filenames = [filename for name, filename in released
+                     if name == setname]
+        if filenames:
+            storage.release_all(setname, filenames)
+    db.session.commit()
+    storage.collect_garbage()
+    for path in orphans:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return released, orphans
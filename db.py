@@ -1,8 +1,58 @@
+import sqlite3
+
 from flask import Flask
-from flask.ext.sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
 import config
+from replica import RoutingSQLAlchemy
 
 app = Flask(__name__)
 app.config.from_object(config)
 
-db = SQLAlchemy(app)
\ No newline at end of file
+db = RoutingSQLAlchemy(app)
+
+
+if app.config['SQLALCHEMY_POOL_PRE_PING']:
+    @event.listens_for(Pool, 'checkout')
+    def ping_connection(dbapi_connection, connection_record, proxy):
+        # a connection the server dropped is replaced instead of failing the
+        # request that checked it out
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        except Exception:
+            raise exc.DisconnectionError()
+        finally:
+            cursor.close()
+
+
+# Python 2's pysqlite commits on its own before a SAVEPOINT, which breaks
+# session.begin_nested(). Its transaction handling is turned off, and a
+# transaction is begun here instead, before the first statement that isn't a
+# SELECT (as Python 3's sqlite3 does), so reads still take no lock until the
+# transaction writes.
+@event.listens_for(Pool, 'connect')
+def sqlite_manual_transactions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.isolation_level = None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def sqlite_begin(conn, cursor, statement, parameters, context, executemany):
+    if (conn.dialect.name == 'sqlite' and conn.in_transaction() and
+            not conn.info.get('sqlite_begun') and
+            not statement.lstrip().upper().startswith('SELECT')):
+        cursor.execute('BEGIN')
+        conn.info['sqlite_begun'] = True
+
+
+@event.listens_for(Engine, 'commit')
+@event.listens_for(Engine, 'rollback')
+def sqlite_end(conn):
+    conn.info.pop('sqlite_begun', None)
+
+
+@event.listens_for(Pool, 'reset')
+def sqlite_reset(dbapi_connection, connection_record):
+    connection_record.info.pop('sqlite_begun', None)
@@ -1,23 +1,71 @@
-from flask import g, redirect, url_for
+import datetime
+import hashlib
+
+from flask import g, redirect, url_for, abort, request, current_app, \
+    make_response
 from functools import wraps
+from sqlalchemy.orm import contains_eager
 
 from models import Course, Assignment, Submission, Presentation
 
 
+def _load(name, entity_id):
+    if name == 'course_id':
+        course = Course.query.filter(Course.id == entity_id).first()
+        return course, {'course': course}
+    elif name == 'assignment_id':
+        assignment = Assignment.query.join(Assignment.course).options(
+            contains_eager(Assignment.course)).filter(
+            Assignment.id == entity_id).first()
+        if assignment is None:
+            return None, {}
+        return assignment.course, {'assignment': assignment}
+    elif name == 'submission_id':
+        submission = Submission.query.join(Submission.assignment).join(
+            Assignment.course).options(
+            contains_eager(Submission.assignment).contains_eager(
+                Assignment.course)).filter(
+            Submission.id == entity_id).first()
+        if submission is None:
+            return None, {}
+        return submission.assignment.course, {
+            'submission': submission, 'assignment': submission.assignment}
+    else:
+        presentation = Presentation.query.join(Presentation.course).options(
+            contains_eager(Presentation.course)).filter(
+            Presentation.id == entity_id).first()
+        if presentation is None:
+            return None, {}
+        return presentation.course, {'presentation': presentation}
+
+
 def get_current_course(kwargs):
-    course = None
-    if 'course_id' in kwargs:
-        course = Course.query.get(kwargs.get('course_id'))
-    elif 'assignment_id' in kwargs:
-        course = Assignment.query.get(kwargs.get('assignment_id')).course
-    elif 'submission_id' in kwargs:
-        course = Submission.query.get(kwargs.get('submission_id')).assignment.course
-    elif 'presentation_id' in kwargs:
-        course = Presentation.query.get(kwargs.get('presentation_id')).course
+    # Loads whatever the URL names, along with its course, in one query and
+    # keeps them on g (g.course, g.assignment, g.submission, g.presentation)
+    # for the view and any other decorator on it. Unknown ids are a 404.
+    for name in ('course_id', 'assignment_id', 'submission_id',
+                 'presentation_id'):
+        if name in kwargs:
+            break
+    else:
+        return None
+    key = (name, kwargs[name])
+    if getattr(g, '_current_key', None) == key:
+        return g.course
+    try:
+        entity_id = int(kwargs[name])
+    except ValueError:
+        abort(404)
+    course, entities = _load(name, entity_id)
+    if course is None:
+        abort(404)
+    g.course = course
+    for attr, entity in entities.items():
+        setattr(g, attr, entity)
+    g._current_key = key
     return course
 
 
-
 def admin_required(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -48,3 +96,48 @@ def course_membership_required(f):
         else:
             return redirect(url_for('home'))
     return wrapper
+
+
+def versioned_page(expires=True, extra=None):
+    # Gives the page a strong ETag built from its course's data version, the
+    # latest display_at that has passed and who is looking, and answers a
+    # matching If-None-Match with 304 before the view runs. Students may
+    # reuse `expires` pages until the next display_at (STUDENT_PAGE_MAX_AGE
+    # at most); everyone else revalidates every time. `extra` is called for
+    # anything else the page shows that doesn't move the course's version.
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            course = get_current_course(kwargs)
+            version, shown, upcoming = course.freshness()
+            if g.user.is_instructor_for(course):
+                role = 'instructor'
+            elif g.user.is_taking(course):
+                role = 'student'
+            else:
+                role = 'visitor'
+            if g.user.is_admin():
+                role += '+admin'
+            etag = hashlib.sha1((u'%s:%s:%s:%s:%s:%s:%s' % (
+                request.full_path, course.id, version, shown, g.user.id,
+                role, extra() if extra else '')).encode('utf-8')).hexdigest()
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            if response.status_code not in (200, 304):
+                return response
+            response.set_etag(etag)
+            response.cache_control.private = True
+            if role == 'student' and expires:
+                max_age = current_app.config['STUDENT_PAGE_MAX_AGE']
+                if upcoming is not None:
+                    until = upcoming - datetime.datetime.now()
+                    max_age = min(max_age, until.days * 86400 + until.seconds)
+                response.cache_control.max_age = max(max_age, 0)
+            else:
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
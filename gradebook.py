@@ -0,0 +1,106 @@
+import csv
+import itertools
+import json
+
+from db import db
+from models import User, Assignment, Submission, student_course_maps
+
+
+# Course gradebook: one row per enrolled student with, for every assignment,
+# the time of the official submission, whether it was late and how many
+# submissions were made. The aggregation is a single grouped query whose
+# result is read from the cursor one student at a time, so memory doesn't
+# grow with the size of the course.
+
+def course_assignments(course):
+    return db.session.query(
+        Assignment.id, Assignment.name, Assignment.due_at).filter(
+        Assignment.course_id == course.id).order_by(
+        Assignment.due_at, Assignment.id).all()
+
+
+def _aggregate(course):
+    users = User.__table__
+    assignments = Assignment.__table__
+    submissions = Submission.__table__
+    official = submissions.c.is_official == True
+    official_at = db.func.max(db.case([(official, submissions.c.submitted_at)]))
+    late = db.func.max(db.case([(db.and_(
+        official, submissions.c.submitted_at > assignments.c.due_at), 1)],
+        else_=0))
+    joined = student_course_maps.join(
+        users, users.c.id == student_course_maps.c.user_id).outerjoin(
+        assignments,
+        assignments.c.course_id == student_course_maps.c.course_id).outerjoin(
+        submissions, db.and_(
+            submissions.c.assignment_id == assignments.c.id,
+            submissions.c.user_id == student_course_maps.c.user_id))
+    return db.select([
+        users.c.id, users.c.username, assignments.c.id,
+        official_at.label('official_at'), late.label('late'),
+        db.func.count(submissions.c.id).label('submissions'),
+    ]).select_from(joined).where(
+        student_course_maps.c.course_id == course.id).group_by(
+        users.c.id, users.c.username, assignments.c.id,
+        assignments.c.due_at).order_by(
+        users.c.username, users.c.id, assignments.c.due_at, assignments.c.id)
+
+
+def rows(course):
+    # yields (username, [(official_at, late, count), ...]) in the order of
+    # course_assignments(course)
+    result = db.session.execute(
+        _aggregate(course).execution_options(stream_results=True))
+    for (user_id, username), group in itertools.groupby(
+            result, lambda row: (row[0], row[1])):
+        yield username, [
+            (official_at, bool(late) if official_at else None, count)
+            for _, _, assignment_id, official_at, late, count in group
+            if assignment_id is not None]
+
+
+class _Line(object):
+    # lets csv.writer hand back each formatted row instead of writing it
+
+    def write(self, value):
+        return value
+
+
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def csv_lines(course):
+    assignments = course_assignments(course)
+    writer = csv.writer(_Line())
+    header = ['username']
+    for _, name, _ in assignments:
+        header.extend([name + ' submitted at', name + ' late',
+                       name + ' submissions'])
+    yield writer.writerow([_utf8(value) for value in header])
+    for username, columns in rows(course):
+        line = [username]
+        for official_at, late, count in columns:
+            line.extend([
+                official_at.isoformat() if official_at else '',
+                {True: 'yes', False: 'no', None: ''}[late],
+                count])
+        yield writer.writerow([_utf8(value) for value in line])
+
+
+def json_lines(course):
+    assignments = course_assignments(course)
+    for username, columns in rows(course):
+        yield json.dumps({
+            'username': username,
+            'assignments': [{
+                'id': assignment_id,
+                'name': name,
+                'submitted_at': official_at.isoformat() if official_at else None,
+                'late': late,
+                'submissions': count,
+            } for (assignment_id, name, _), (official_at, late, count)
+                in zip(assignments, columns)],
+        }) + '\n'
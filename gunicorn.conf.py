@@ -0,0 +1,29 @@
+import multiprocessing
+import os
+
+
+# gunicorn -c gunicorn.conf.py wsgi:application
+#
+# WEB_CONCURRENCY sets the number of worker processes and WEB_THREADS the
+# threads in each. Requests spend most of their time waiting on the database
+# and LDAP, so the default is two workers per core plus one, single threaded.
+# Each worker keeps its own database connection pool and up to
+# LDAP_POOL_SIZE directory connections.
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get(
+    'WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 1))
+timeout = 120  # large uploads on slow links
+preload_app = True
+
+# terminate TLS here when there's no proxy in front
+certfile = os.environ.get('SSL_CERTFILE')
+keyfile = os.environ.get('SSL_KEYFILE')
+
+
+def post_fork(server, worker):
+    # connections opened while preloading belong to the master; each worker
+    # opens its own. The LDAP pool notices the new pid by itself.
+    from db import db
+    db.engine.dispose()
@@ -0,0 +1,271 @@
+import datetime
+import errno
+import fcntl
+import glob
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+from flask.ext.uploads import UploadNotAllowed
+from werkzeug.utils import secure_filename
+
+from db import app, db
+from models import Assignment, Submission, bump_course_version
+from uploads import submissions
+import manifests
+import storage
+
+
+# Deadline-surge ingest. With SUBMISSION_INGEST on, new_submission only
+# spools the upload to disk (hashed and fsync'd, as storage.save does) and
+# writes a job file saying who sent it and when it arrived, then answers.
+# A single writer, `manager.py ingest_submissions`, turns the queued jobs into
+# Submission rows a batch at a time, in one transaction per batch, making each
+# student's latest upload official. submitted_at is the arrival time, so
+# lateness doesn't depend on how far behind the writer is. Jobs are only
+# removed after their batch commits, and Submission.receipt makes replaying
+# a job after a crash harmless. If a batch fails, its jobs are retried one
+# at a time, and a job that fails on its own is moved into failed/ in the
+# queue directory so it can't stop the writer.
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+log = logging.getLogger(__name__)
+
+
+class WriterRunning(Exception):
+    pass
+
+
+def queue_dir():
+    dest = app.config['UPLOADS_INGEST_DEST']
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    return dest
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def enqueue(user, assignment, upload):
+    # returns (receipt, received_at) once the upload and its job are on disk
+    received_at = datetime.datetime.now()
+    basename = secure_filename(upload.filename)
+    if not submissions.file_allowed(upload, basename):
+        raise UploadNotAllowed()
+    digest, size, tmp = storage.spool(upload.stream)
+    receipt = uuid.uuid4().hex
+    job = {
+        'receipt': receipt,
+        'received_at': received_at.strftime(TIME_FORMAT),
+        'user_id': user.id,
+        'assignment_id': assignment.id,
+        'filename': basename,
+        'digest': digest,
+        'size': size,
+        'tmp': tmp,
+    }
+    # sortable by arrival, and findable per student and assignment
+    name = '%s-%d-%d-%s.json' % (received_at.strftime('%Y%m%d%H%M%S%f'),
+                                 assignment.id, user.id, receipt)
+    dest = queue_dir()
+    partial = os.path.join(dest, '.' + name)
+    with open(partial, 'w') as f:
+        json.dump(job, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(partial, os.path.join(dest, name))
+    _fsync_dir(dest)
+    return receipt, received_at
+
+
+def _load(path):
+    with open(path) as f:
+        job = json.load(f)
+    job['received_at'] = datetime.datetime.strptime(
+        job['received_at'], TIME_FORMAT)
+    return job
+
+
+def queued():
+    dest = queue_dir()
+    jobs = []
+    for name in os.listdir(dest):
+        if name.endswith('.json') and not name.startswith('.'):
+            try:
+                jobs.append(_load(os.path.join(dest, name)))
+            except (IOError, OSError, ValueError):
+                continue
+    return jobs
+
+
+def _queued_paths(user, assignment):
+    return glob.glob(os.path.join(
+        queue_dir(), '*-%d-%d-*.json' % (assignment.id, user.id)))
+
+
+def pending_receipts(user, assignment):
+    # receipts of this student's uploads the writer hasn't recorded yet, from
+    # the job names alone; the assignment page's ETag includes them
+    return sorted(os.path.basename(path)[:-len('.json')].rsplit('-', 1)[1]
+                  for path in _queued_paths(user, assignment))
+
+
+def pending_for(user, assignment):
+    # arrival times of this student's uploads the writer hasn't recorded yet
+    received = []
+    for path in _queued_paths(user, assignment):
+        try:
+            received.append(_load(path)['received_at'])
+        except (IOError, OSError, ValueError):
+            continue  # just committed and removed
+    return sorted(received)
+
+
+def _restore_spooled(job):
+    # a crashed batch may already have moved the temp file into the blob
+    # store without committing the Blob row
+    blob = storage.blob_path(job['digest'])
+    try:
+        os.link(blob, job['tmp'])
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copyfile(blob, job['tmp'])
+
+
+def _existing_assignments(jobs):
+    return db.session.query(Assignment.id).filter(
+        Assignment.id.in_(set(job['assignment_id'] for job in jobs)))
+
+
+def _next_names(limit):
+    names = sorted(name for name in os.listdir(queue_dir())
+                   if name.endswith('.json') and not name.startswith('.'))
+    return names[:limit]
+
+
+def drain(limit=100):
+    # records up to `limit` queued jobs in one transaction; returns how many
+    # jobs were handled
+    return _record(_next_names(limit))
+
+
+def _record(names):
+    dest = queue_dir()
+    if not names:
+        return 0
+    jobs = [_load(os.path.join(dest, name)) for name in names]
+    recorded = set(receipt for receipt, in db.session.query(
+        Submission.receipt).filter(
+        Submission.receipt.in_([job['receipt'] for job in jobs])))
+
+    # locked, so a deletion waits for this batch to commit (or this batch
+    # waits for the deletion, and skips its jobs)
+    assignments = _existing_assignments(jobs).with_for_update().all()
+    assignments = set(assignment_id for assignment_id, in assignments)
+
+    created = []
+    latest = {}
+    for job in jobs:
+        if job['receipt'] in recorded:
+            continue
+        if job['assignment_id'] not in assignments:
+            # deleted while the job was queued
+            if os.path.exists(job['tmp']):
+                os.remove(job['tmp'])
+            continue
+        if not os.path.exists(job['tmp']):
+            _restore_spooled(job)
+        filename = storage.save_file(
+            submissions, job['tmp'], job['filename'], job['digest'],
+            job['size'])
+        submission = Submission(
+            filename=filename,
+            is_official=False,
+            assignment_id=job['assignment_id'],
+            user_id=job['user_id'],
+            submitted_at=job['received_at'],
+            receipt=job['receipt'])
+        db.session.add(submission)
+        created.append(submission)
+        # jobs are in arrival order, so the last one per student wins
+        latest[(job['assignment_id'], job['user_id'])] = submission
+    db.session.flush()
+    # SQLite ignores FOR UPDATE, but once the batch has written it holds the
+    # database's write lock; an assignment deleted before that is caught here
+    # and the batch starts over without it
+    if created and len(assignments) != _existing_assignments(jobs).count():
+        db.session.rollback()
+        return _record(names)
+
+    if latest:
+        students = db.or_(*[db.and_(Submission.assignment_id == assignment_id,
+                                    Submission.user_id == user_id)
+                            for assignment_id, user_id in latest])
+        Submission.query.filter(
+            students, Submission.is_official == True).update(
+            {Submission.is_official: False}, synchronize_session=False)
+        Submission.query.filter(Submission.id.in_(
+            [official.id for official in latest.values()])).update(
+            {Submission.is_official: True}, synchronize_session=False)
+        for assignment_id in set(key[0] for key in latest):
+            bump_course_version(db.select([Assignment.course_id]).where(
+                Assignment.id == assignment_id).as_scalar())
+    db.session.commit()
+
+    for name in names:
+        os.remove(os.path.join(dest, name))
+    for submission in created:
+        manifests.schedule(submission)
+    return len(names)
+
+
+def run_writer(batch_size=100, interval=0.5, once=False):
+    lock = open(os.path.join(queue_dir(), '.writer.lock'), 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        raise WriterRunning('another ingest writer is running')
+    while True:
+        try:
+            handled = drain(batch_size)
+        except Exception:
+            db.session.rollback()
+            log.exception('Ingest batch failed, retrying its jobs one by one')
+            handled = _record_singly(batch_size)
+        db.session.remove()
+        if once and not handled:
+            return
+        if not handled:
+            time.sleep(interval)
+
+
+def _record_singly(limit):
+    names = _next_names(limit)
+    for name in names:
+        try:
+            _record([name])
+        except Exception:
+            db.session.rollback()
+            log.exception('Ingest job %s failed, moving it to failed/', name)
+            _set_aside(name)
+    return len(names)
+
+
+def _set_aside(name):
+    path = os.path.join(queue_dir(), name)
+    if not os.path.exists(path):
+        return  # it was recorded before what failed after
+    failed = os.path.join(queue_dir(), 'failed')
+    if not os.path.isdir(failed):
+        os.makedirs(failed)
+    os.rename(path, os.path.join(failed, name))
@@ -0,0 +1,121 @@
+import time
+
+from flask import g, request, has_request_context
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+
+# Per-request accounting of SQL statements, LDAP calls and template rendering.
+# It feeds the Server-Timing header, the slow request log and the process-wide
+# metrics served at /metrics.
+
+CATEGORIES = ('sql', 'ldap', 'render')
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.start = time.time()
+        self.counts = dict((category, 0) for category in CATEGORIES)
+        self.durations = dict((category, 0.0) for category in CATEGORIES)
+        self.statements = []
+
+    def record(self, category, seconds):
+        self.counts[category] += 1
+        self.durations[category] += seconds
+
+    def server_timing(self, total):
+        parts = ['%s;dur=%.1f;desc="%d"' % (
+            category, self.durations[category] * 1000, self.counts[category])
+            for category in CATEGORIES]
+        parts.append('total;dur=%.1f' % (total * 1000))
+        return ', '.join(parts)
+
+
+def current_stats():
+    if has_request_context():
+        return getattr(g, '_request_stats', None)
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_start', []).append(time.time())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    seconds = time.time() - conn.info['query_start'].pop()
+    metrics.observe('sql_query_seconds', seconds)
+    stats = current_stats()
+    if stats is not None:
+        stats.record('sql', seconds)
+        stats.statements.append((seconds, statement))
+
+
+def _on_metric(name, seconds):
+    # LDAP timings come from utils through the metrics module
+    if name in ('ldap_search_seconds', 'ldap_bind_seconds'):
+        stats = current_stats()
+        if stats is not None:
+            stats.record('ldap', seconds)
+
+
+class TimedTemplate(Template):
+
+    def render(self, *args, **kwargs):
+        start = time.time()
+        try:
+            return Template.render(self, *args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            metrics.observe('template_render_seconds', seconds)
+            stats = current_stats()
+            if stats is not None:
+                stats.record('render', seconds)
+
+
+def init_app(app):
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    metrics.add_listener(_on_metric)
+    app.jinja_env.template_class = TimedTemplate
+
+    def start_request_stats():
+        g._request_stats = RequestStats()
+
+    # ahead of the hooks already registered, so the SQL and LDAP calls that
+    # load the logged-in user are counted too
+    app.before_request_funcs.setdefault(None, []).insert(
+        0, start_request_stats)
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = current_stats()
+        if stats is None:
+            return response
+        total = time.time() - stats.start
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe('http_request_seconds', total, endpoint=endpoint)
+        for category in CATEGORIES:
+            metrics.incr('%s_calls_total' % category, stats.counts[category],
+                         endpoint=endpoint)
+        if stats.counts['sql'] > app.config['QUERY_BUDGETS'].get(
+                endpoint, app.config['QUERY_BUDGET_DEFAULT']):
+            metrics.incr('query_budget_exceeded_total', endpoint=endpoint)
+            app.logger.warning('%s ran %d SQL statements, over its budget',
+                               endpoint, stats.counts['sql'])
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = stats.server_timing(total)
+        if total >= app.config['SLOW_REQUEST_THRESHOLD']:
+            slowest = sorted(stats.statements, reverse=True)[:10]
+            lines = ['Slow request: %s %s took %.3fs (%s)' % (
+                request.method, request.path, total,
+                stats.server_timing(total))]
+            lines.extend('  %.1fms  %s' % (seconds * 1000, ' '.join(
+                statement.split())) for seconds, statement in slowest)
+            app.logger.warning('\n'.join(lines))
+        return response
@@ -0,0 +1,312 @@
+import cookielib
+import datetime
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+from db import app, db
+from models import User, Assignment, Submission, student_course_maps
+import storage
+import utils
+
+
+# Replays a deadline night against the app under gunicorn: every student of
+# one assignment logs in at once, loads the dashboard and the assignment, and
+# then submits and downloads through the last minutes before due_at, with
+# arrivals bunching up towards the deadline. Latency percentiles and
+# throughput are reported per route so runs can be compared between commits.
+#
+#   python2 manager.py seed_synthetic --yes-drop
+#   python2 manager.py loadtest_serve --workers 4
+#   python2 manager.py loadtest_run --url http://127.0.0.1:8000 -o before.json
+
+UPLOAD_SIZE = 256 * 1024
+DOWNLOAD_SIZE = 1024 * 1024
+
+# seconds the run compresses the last 15 minutes before the deadline into;
+# loadtest_serve sets due_at this far out and loadtest_run aims its arrivals
+# at due_at, so both take the same value
+WINDOW = 60
+
+
+# LDAP stand-in: answers uid/uidNumber searches from the users table after a
+# fixed delay, so logins and profile refreshes cost a round trip without a
+# directory server.
+
+LDAP_FILTER = re.compile(r'^\(?(uid|uidNumber)=([^)]*)\)?$')
+
+
+def _standin_search(latency):
+    def ldap_search(filterstr):
+        time.sleep(latency)
+        match = LDAP_FILTER.match(filterstr)
+        if match is None:
+            return []
+        attribute, value = match.groups()
+        if attribute == 'uid':
+            user = User.query.filter(User.username == value).first()
+        else:
+            user = User.query.get(int(value))
+        if user is None:
+            return []
+        return [{
+            'gecos': [user.username],
+            'uid': [user.username],
+            'uidNumber': [str(user.id)],
+            'gidNumber': ['100'],
+            'mail': [user.email],
+            'wpieduPersonUUID': [str(user.id)],
+        }]
+    return ldap_search
+
+
+class _StandinConnection(object):
+    # accepts any password, like the bind the real directory would do
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def _prepare(assignment_id, window):
+    # move the deadline to the end of the flood and make sure the seeded
+    # submissions exist on disk so downloads transfer real bytes
+    assignment = Assignment.query.get(assignment_id)
+    now = datetime.datetime.now().replace(microsecond=0)
+    assignment.due_at = now + datetime.timedelta(seconds=window)
+    assignment.display_at = now - datetime.timedelta(days=14)
+    db.session.commit()
+
+    # the seeded blobs are tiny, so the downloaded submissions get full-size
+    # files of their own in the upload set directory instead
+    official = [filename for filename, in db.session.query(
+        Submission.filename).filter(
+        Submission.assignment_id == assignment_id,
+        Submission.is_official == True)]
+    storage.release_all('submissions', official)
+    db.session.commit()
+
+    destination = app.upload_set_config['submissions'].destination
+    if not os.path.isdir(destination):
+        os.makedirs(destination)
+    for filename in official:
+        path = os.path.join(destination, filename)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(os.urandom(DOWNLOAD_SIZE))
+
+
+def serve(assignment_id=1, window=WINDOW, workers=4, threads=1,
+          bind='127.0.0.1:8000', ldap_latency=0.005):
+    from gunicorn.app.base import BaseApplication
+    from wsgi import create_app
+
+    utils.ldap_search = _standin_search(ldap_latency)
+    utils.simpleldap.Connection = _StandinConnection
+    application = create_app()
+    with app.app_context():
+        _prepare(assignment_id, window)
+    # every worker opens its own connections after the fork
+    db.engine.dispose()
+
+    class LoadTestApplication(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', bind)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+
+        def load(self):
+            return application
+
+    LoadTestApplication().run()
+
+
+class _NoRedirect(urllib2.HTTPRedirectHandler):
+    # each request is timed on its own, so redirects are not followed
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _multipart(field, filename, data):
+    boundary = '----wpia%x' % random.getrandbits(64)
+    body = '\r\n'.join([
+        '--' + boundary,
+        'Content-Disposition: form-data; name="%s"; filename="%s"' % (
+            field, filename),
+        'Content-Type: application/zip',
+        '',
+        data,
+        '--' + boundary + '--',
+        ''])
+    return body, 'multipart/form-data; boundary=' + boundary
+
+
+class Recorder(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def report(self, elapsed):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            routes[route] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(route, 0),
+                'throughput': len(latencies) / elapsed,
+                'p50': _percentile(latencies, 50),
+                'p95': _percentile(latencies, 95),
+                'p99': _percentile(latencies, 99),
+            }
+        return routes
+
+
+def _percentile(ordered, percent):
+    index = int(math.ceil(percent / 100.0 * len(ordered))) - 1
+    return ordered[max(index, 0)]
+
+
+class Student(threading.Thread):
+
+    def __init__(self, base_url, username, assignment_id, download, start,
+                 flood_at, recorder):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.base_url = base_url
+        self.username = username
+        self.assignment_id = assignment_id
+        self.download = download
+        self.start_event = start
+        self.flood_at = flood_at
+        self.recorder = recorder
+        self.opener = urllib2.build_opener(
+            urllib2.HTTPCookieProcessor(cookielib.CookieJar()), _NoRedirect)
+
+    def request(self, route, path, data=None, headers=None, redirect=None):
+        # a page is expected to answer 200, or a redirect to `redirect`; a
+        # redirect anywhere else (like the login page) is an error
+        request = urllib2.Request(self.base_url + path, data, headers or {})
+        start = time.time()
+        try:
+            response = self.opener.open(request)
+            response.read()
+            ok = redirect is None and response.getcode() == 200
+        except urllib2.HTTPError as e:
+            e.read()
+            location = e.info().get('Location') or ''
+            ok = (redirect is not None and e.code == 302 and
+                  urlparse.urlparse(location).path == redirect)
+        except Exception:
+            ok = False
+        self.recorder.add(route, time.time() - start, ok)
+        return ok
+
+    def run(self):
+        assignment = '/assignments/%d' % self.assignment_id
+        self.start_event.wait()
+        if not self.request('POST /login', '/login', urllib.urlencode(
+                {'username': self.username, 'password': 'loadtest'}),
+                redirect='/'):
+            return
+        self.request('GET /', '/')
+        self.request('GET /assignments/<id>', assignment)
+
+        time.sleep(max(self.flood_at - time.time(), 0))
+        body, content_type = _multipart(
+            'file', '%s.zip' % self.username, os.urandom(UPLOAD_SIZE))
+        self.request('POST /assignments/<id>/submissions/new',
+                     assignment + '/submissions/new', body,
+                     {'Content-Type': content_type}, redirect=assignment)
+        self.request('GET /assignments/<id>', assignment)
+        if self.download:
+            self.request('GET /uploads/submissions/<file>',
+                         '/uploads/submissions/' + self.download)
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(base_url, assignment_id=1, window=WINDOW, seed=0):
+    # arrivals fall in the `window` seconds before the assignment's due_at,
+    # with a density rising linearly towards it; any that are already past
+    # when the run starts arrive at once
+    rng = random.Random(seed)
+    with app.app_context():
+        assignment = Assignment.query.get(assignment_id)
+        course_id = assignment.course_id
+        deadline = time.mktime(assignment.due_at.timetuple())
+        students = db.session.query(User.id, User.username).join(
+            student_course_maps,
+            student_course_maps.c.user_id == User.id).filter(
+            student_course_maps.c.course_id == course_id).all()
+        downloads = dict(db.session.query(
+            Submission.user_id, Submission.filename).filter(
+            Submission.assignment_id == assignment_id,
+            Submission.is_official == True))
+
+    recorder = Recorder()
+    start = threading.Event()
+    began = time.time()
+    workers = [Student(base_url.rstrip('/'), username, assignment_id,
+                       downloads.get(user_id), start,
+                       deadline - window * (1 - math.sqrt(rng.random())),
+                       recorder)
+               for user_id, username in students]
+    for worker in workers:
+        worker.start()
+    start.set()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - began
+
+    return {
+        'commit': _commit(),
+        'url': base_url,
+        'students': len(students),
+        'window': window,
+        'elapsed': elapsed,
+        'routes': recorder.report(elapsed),
+    }
+
+
+def format_report(report):
+    lines = ['%d students, %.1fs, commit %s' % (
+        report['students'], report['elapsed'], report['commit'])]
+    lines.append('%-42s %6s %6s %8s %8s %8s %8s' % (
+        'route', 'reqs', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for route, stats in sorted(report['routes'].items()):
+        lines.append('%-42s %6d %6d %8.1f %8.1f %8.1f %8.1f' % (
+            route, stats['requests'], stats['errors'], stats['throughput'],
+            stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000))
+    return '\n'.join(lines)
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
@@ -1,15 +1,210 @@
 
+import datetime
+
 from flask.ext.script import Manager
+from sqlalchemy import event
 from flask.ext.migrate import Migrate, MigrateCommand
 
 from db import db, app
 from models import *
+import budgets
+import chunked
+import cleanup
+import ingest
+import loadtest
+import manifests
+import roster
+import synthetic
+from wsgi import create_app
 
 
-migrate = Migrate(app, db)
+# batch mode lets autogenerated migrations alter tables on SQLite too
+migrate = Migrate(app, db, render_as_batch=True)
 
-manager = Manager(app)
+manager = Manager(create_app())
 manager.add_command('db', MigrateCommand)
 
+
+@manager.command
+def purge_chunked_uploads(hours=24):
+    "Discard chunked uploads that were started but never completed"
+    cutoff = datetime.datetime.now() - datetime.timedelta(hours=hours)
+    stale = ChunkedUpload.query.filter(ChunkedUpload.created_at < cutoff)
+    for upload in stale.all():
+        chunked.discard(upload)
+    db.session.commit()
+
+
+@manager.command
+def sweep_uploads(hours=24, dry_run=False):
+    "Remove upload files nothing refers to (untouched for the given hours)"
+    released, removed = cleanup.sweep(hours * 60 * 60, dry_run)
+    for setname, filename in released:
+        print('%s %s/%s' % (
+            'would release' if dry_run else 'released', setname, filename))
+    for path in removed:
+        print('%s %s' % ('would remove' if dry_run else 'removed', path))
+
+
+@manager.command
+def sync_roster(course_id, path, role='students', yes=False):
+    "Make a course's students (or instructors) match a CSV of usernames"
+    course = Course.query.get(course_id)
+    if course is None:
+        print('No course with id %s' % course_id)
+        raise SystemExit(1)
+    with open(path) as f:
+        usernames = roster.parse_usernames(f)
+    try:
+        diff = roster.sync_roster(course, usernames, role, confirmed=yes)
+    except roster.RemovalsNeedConfirming as e:
+        print('Would remove %d members: %s' % (
+            len(e.removed), ' '.join(e.removed)))
+        print('Run again with --yes to sync anyway.')
+        return
+    except roster.RosterError as e:
+        print('Roster not synced: %s' % e)
+        return
+    for key in ('added', 'removed', 'unknown'):
+        print('%s (%d): %s' % (key, len(diff[key]), ' '.join(diff[key])))
+
+
+def hot_lookup_plans():
+    # [(statement, plan rows)] for the lookups every page makes, or None
+    # without at least one user, course, assignment, submission and
+    # presentation to run them for
+    user = User.query.first()
+    course = Course.query.first()
+    assignment = Assignment.query.first()
+    submission = Submission.query.first()
+    presentation = Presentation.query.first()
+    if None in (user, course, assignment, submission, presentation):
+        return None
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            captured.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        with app.test_request_context():
+            user.get_membership()
+            user._check_permission_to_read('submissions', submission.filename)
+            user._check_permission_to_read(
+                'presentations', presentation.filename)
+            user._check_permission_to_read('syllabi', 'syllabus.pdf')
+            user._check_permission_to_read('assignments', 'description.pdf')
+            upcoming_cache.delete(user.id)
+            user.get_upcoming_assignments()
+            course.get_visible_assignments()
+            course.get_visible_presentations()
+            assignment.get_submissions_from_user(user)
+            assignment.official_submissions().all()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    if db.engine.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    return [(statement.strip(),
+             list(db.engine.execute(prefix + statement, parameters)))
+            for statement, parameters in captured]
+
+
+@manager.command
+def explain():
+    "Print the query plans of the hot lookups; run it on a populated database"
+    plans = hot_lookup_plans()
+    if plans is None:
+        print('Needs at least one user, course, assignment, submission and '
+              'presentation.')
+        return
+    for statement, plan in plans:
+        print(statement)
+        for row in plan:
+            print('    %s' % (row,))
+        print('')
+
+
+@manager.command
+def ingest_submissions(batch=100, interval=0.5, once=False):
+    "Record queued submissions in batches (the single ingest writer)"
+    try:
+        ingest.run_writer(batch_size=batch, interval=interval, once=once)
+    except ingest.WriterRunning as e:
+        print(e)
+        raise SystemExit(1)
+
+
+@manager.command
+def index_manifests():
+    "List the contents of submissions that haven't been indexed yet"
+    for submission_id in manifests.pending():
+        manifests.index_submission(submission_id)
+
+
+@manager.option('--courses', dest='courses', type=int, default=50)
+@manager.option('--users', dest='users', type=int, default=2000)
+@manager.option('--assignments', dest='assignments', type=int, default=500)
+@manager.option('--submissions', dest='submissions', type=int, default=50000)
+@manager.option('--yes-drop', dest='yes_drop', action='store_true',
+                default=False)
+def seed_synthetic(courses, users, assignments, submissions, yes_drop):
+    "Replace the database contents with a synthetic dataset (no LDAP needed)"
+    if not yes_drop:
+        print('This drops every table in %s first; run it against a scratch '
+              'database with --yes-drop.' % db.engine.url)
+        raise SystemExit(1)
+    summary = synthetic.build(
+        courses=courses, users=users, assignments=assignments,
+        submissions=submissions,
+        admin_usernames=app.config['ADMIN_USERNAMES'][:1])
+    print(', '.join('%d %s' % (v, k) for k, v in sorted(summary.items())))
+
+
+@manager.command
+def check_budgets():
+    "Fail if any page exceeds its query or time budget"
+    failed = False
+    for r in budgets.run():
+        print('%-4s %-22s %-3s %4s queries (budget %2d) %7.1fms %s %s' % (
+            'ok' if r['ok'] else 'FAIL', r['endpoint'], r['role'],
+            r['queries'], r['budget'], r['seconds'] * 1000, r['status'],
+            r['path']))
+        failed = failed or not r['ok']
+    if failed:
+        raise SystemExit(1)
+
+
+@manager.option('-a', '--assignment', dest='assignment', type=int, default=1)
+@manager.option('--window', dest='window', type=float,
+                default=loadtest.WINDOW)
+@manager.option('-w', '--workers', dest='workers', type=int, default=4)
+@manager.option('-t', '--threads', dest='threads', type=int, default=1)
+@manager.option('-b', '--bind', dest='bind', default='127.0.0.1:8000')
+@manager.option('-l', '--ldap_latency', dest='ldap_latency', type=float,
+                default=0.005)
+def loadtest_serve(assignment, window, workers, threads, bind, ldap_latency):
+    "Serve the app under gunicorn with an LDAP stand-in for load tests"
+    loadtest.serve(assignment_id=assignment, window=window, workers=workers,
+                   threads=threads, bind=bind, ldap_latency=ldap_latency)
+
+
+@manager.option('-u', '--url', dest='url', default='http://127.0.0.1:8000')
+@manager.option('-a', '--assignment', dest='assignment', type=int, default=1)
+@manager.option('-w', '--window', dest='window', type=float,
+                default=loadtest.WINDOW)
+@manager.option('-o', '--output', dest='output', default=None)
+def loadtest_run(url, assignment, window, output):
+    "Replay a deadline night against loadtest_serve and report latencies"
+    report = loadtest.run(url, assignment_id=assignment, window=window)
+    print(loadtest.format_report(report))
+    if output:
+        loadtest.save_report(report, output)
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,120 @@
+import logging
+import multiprocessing
+import os
+import tarfile
+import threading
+import zipfile
+
+from db import app, db
+from models import Assignment, Submission, ManifestEntry
+import storage
+
+
+# Lists what's inside submitted archives so graders can see it without
+# downloading them. Only the index is read: a zip's central directory or a
+# tar's member headers. The work runs in a small process pool owned by each
+# web worker; it's created on first use, i.e. after the server has forked.
+# Submissions whose status is still NULL (say, the worker restarted before
+# getting to them) are picked up by `manager.py index_manifests`.
+
+TAR_EXTENSIONS = ('.tar', '.tgz', '.tar.gz', '.tar.bz2', '.tbz2')
+
+log = logging.getLogger(__name__)
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def read_manifest(path, filename, limit):
+    # returns (status, [(path, size), ...]) with at most `limit` entries
+    name = filename.lower()
+    try:
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                entries = [(info.filename, info.file_size)
+                           for info in archive.infolist()
+                           if not info.filename.endswith('/')]
+        elif name.endswith(TAR_EXTENSIONS):
+            entries = []
+            with tarfile.open(path) as archive:
+                for member in archive:
+                    if member.isfile():
+                        entries.append((member.name, member.size))
+        else:
+            return 'unsupported', []
+    except tarfile.CompressionError:
+        return 'unsupported', []
+    except (zipfile.BadZipfile, zipfile.LargeZipFile, tarfile.TarError,
+            EOFError, IOError, ValueError):
+        return 'corrupt', []
+    if not entries:
+        return 'empty', []
+    return 'ok', entries[:limit]
+
+
+def index_submission(submission_id):
+    with app.app_context():
+        submission = Submission.query.get(submission_id)
+        if submission is None or submission.manifest_status is not None:
+            return
+        path = storage.path_for('submissions', submission.filename)
+        if os.path.isfile(path):
+            status, entries = read_manifest(
+                path, submission.filename, app.config['MANIFEST_MAX_ENTRIES'])
+        else:
+            status, entries = 'missing', []
+        if entries:
+            db.session.execute(ManifestEntry.__table__.insert(), [
+                {'submission_id': submission.id, 'path': entry_path,
+                 'size': size} for entry_path, size in entries])
+        submission.manifest_status = status
+        assignment = Assignment.__table__
+        db.session.execute(assignment.update().where(
+            assignment.c.id == submission.assignment_id).values(
+            manifest_version=assignment.c.manifest_version + 1))
+        db.session.commit()
+        db.session.remove()
+
+
+def _run(submission_id):
+    try:
+        index_submission(submission_id)
+    except Exception:
+        log.exception('Indexing submission %s failed', submission_id)
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # the workers are forked with this process's memory; let go of
+            # its pooled connections first, so they're never shared with a
+            # worker (closing them in the worker would close them here too)
+            db.engine.dispose()
+            _pool = multiprocessing.Pool(app.config['MANIFEST_WORKERS'])
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def schedule(submission):
+    # call once the submission is committed
+    if app.config['MANIFEST_WORKERS']:
+        _get_pool().apply_async(_run, (submission.id,))
+
+
+def pending():
+    return [submission_id for submission_id, in db.session.query(
+        Submission.id).filter(Submission.manifest_status == None).order_by(
+        Submission.id)]
+
+
+def entries_for(submission_ids):
+    # {submission id: [ManifestEntry, ...]} in one query
+    manifests = dict((submission_id, []) for submission_id in submission_ids)
+    if submission_ids:
+        for entry in ManifestEntry.query.filter(
+                ManifestEntry.submission_id.in_(submission_ids)).order_by(
+                ManifestEntry.submission_id, ManifestEntry.path):
+            manifests[entry.submission_id].append(entry)
+    return manifests
@@ -0,0 +1,71 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Process-wide counters and timings. Metrics are keyed by name plus optional
+# labels; with several workers each process keeps its own numbers.
+
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+_listeners = []
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def incr(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        count, total, peak = _timings.get(key, (0, 0.0, 0.0))
+        _timings[key] = (count + 1, total + seconds, max(peak, seconds))
+    for listener in _listeners:
+        listener(name, seconds)
+
+
+def add_listener(listener):
+    # called with (name, seconds) on every observation
+    _listeners.append(listener)
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, **labels)
+
+
+def snapshot():
+    with _lock:
+        return dict(_counters), dict(_timings)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels)
+
+
+def render_prometheus():
+    counters, timings = snapshot()
+    lines = []
+    for (name, labels), value in sorted(counters.items()):
+        lines.append('%s%s %s' % (name, _format_labels(labels), value))
+    for (name, labels), (count, total, peak) in sorted(timings.items()):
+        formatted = _format_labels(labels)
+        lines.append('%s_count%s %d' % (name, formatted, count))
+        lines.append('%s_sum%s %f' % (name, formatted, total))
+        lines.append('%s_max%s %f' % (name, formatted, peak))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,34 @@
+"""index upload filename columns
+
+Revision ID: 2663b48e8d1c
+Revises: c086f1d670ab
+Create Date: 2026-10-18 16:00:01.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2663b48e8d1c'
+down_revision = 'c086f1d670ab'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('course', 'syllabus_filename'),
+    ('assignment', 'description_filename'),
+    ('presentation', 'filename'),
+    ('submission', 'filename'),
+]
+
+
+def upgrade():
+    for table, column in INDEXES:
+        op.create_index(
+            op.f('ix_%s_%s' % (table, column)), table, [column], unique=False)
+
+
+def downgrade():
+    for table, column in reversed(INDEXES):
+        op.drop_index(op.f('ix_%s_%s' % (table, column)), table_name=table)
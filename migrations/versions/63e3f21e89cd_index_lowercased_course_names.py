@@ -0,0 +1,25 @@
+"""index lowercased course names
+
+Revision ID: 63e3f21e89cd
+Revises: b46a1429ebb2
+Create Date: 2026-10-18 16:00:07.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '63e3f21e89cd'
+down_revision = 'b46a1429ebb2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_course_name_lower', 'course',
+                    [sa.text('lower(name)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_course_name_lower', table_name='course')
@@ -0,0 +1,56 @@
+"""add submission manifests
+
+Revision ID: 6dad5a507d1c
+Revises: 63e3f21e89cd
+Create Date: 2026-10-18 16:00:08.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6dad5a507d1c'
+down_revision = '63e3f21e89cd'
+branch_labels = None
+depends_on = None
+
+
+# Existing submissions start without a manifest_status; `manager.py
+# index_manifests` lists them.
+
+
+def upgrade():
+    op.add_column('submission',
+                  sa.Column('manifest_status', sa.String(length=16),
+                            nullable=True))
+    op.add_column('assignment',
+                  sa.Column('manifest_version', sa.Integer(), nullable=False,
+                            server_default='0'))
+    op.create_table(
+        'manifest_entry',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('submission_id', sa.Integer(), nullable=False),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['submission_id'], ['submission.id']),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_index(op.f('ix_manifest_entry_submission_id'), 'manifest_entry',
+                    ['submission_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_manifest_entry_submission_id'),
+                  table_name='manifest_entry')
+    op.drop_table('manifest_entry')
+    with op.batch_alter_table('assignment') as batch_op:
+        batch_op.drop_column('manifest_version')
+    # batch mode rebuilds the table on SQLite from its reflection, which
+    # loses the partial index's WHERE; it's put back as it was afterwards
+    op.drop_index('uq_submission_official', table_name='submission')
+    with op.batch_alter_table('submission') as batch_op:
+        batch_op.drop_column('manifest_status')
+    op.create_index('uq_submission_official', 'submission',
+                    ['assignment_id', 'user_id'], unique=True,
+                    postgresql_where=sa.text('is_official'),
+                    sqlite_where=sa.text('is_official'))
@@ -0,0 +1,35 @@
+"""add chunked upload table
+
+Revision ID: a05f11c610b3
+Revises: ae3bd624ad33
+Create Date: 2026-10-18 16:00:03.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a05f11c610b3'
+down_revision = 'ae3bd624ad33'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'chunked_upload',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('received', sa.BigInteger(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('assignment_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['assignment_id'], ['assignment.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('chunked_upload')
@@ -0,0 +1,47 @@
+"""add blob store tables
+
+Revision ID: ae3bd624ad33
+Revises: 2663b48e8d1c
+Create Date: 2026-10-18 16:00:02.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ae3bd624ad33'
+down_revision = '2663b48e8d1c'
+branch_labels = None
+depends_on = None
+
+
+# Files uploaded before this revision stay where they are in the upload set
+# directories; storage.path_for() falls back to them when no StoredFile row
+# names the file.
+
+
+def upgrade():
+    op.create_table(
+        'blob',
+        sa.Column('digest', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('digest'))
+    op.create_index(op.f('ix_blob_refcount'), 'blob', ['refcount'],
+                    unique=False)
+    op.create_table(
+        'stored_file',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('setname', sa.String(length=40), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('blob_digest', sa.String(length=64), nullable=False),
+        sa.ForeignKeyConstraint(['blob_digest'], ['blob.digest']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('setname', 'filename'))
+
+
+def downgrade():
+    op.drop_table('stored_file')
+    op.drop_index(op.f('ix_blob_refcount'), table_name='blob')
+    op.drop_table('blob')
@@ -0,0 +1,78 @@
+"""key enrollments and index the hot lookups
+
+Revision ID: b46a1429ebb2
+Revises: d494c2f7d8fb
+Create Date: 2026-10-18 16:00:06.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b46a1429ebb2'
+down_revision = 'd494c2f7d8fb'
+branch_labels = None
+depends_on = None
+
+ENROLLMENTS = ('student_course_maps', 'instructor_course_maps')
+
+INDEXES = [
+    ('ix_assignment_course_display_at', 'assignment',
+     ['course_id', 'display_at']),
+    ('ix_assignment_course_due_at', 'assignment', ['course_id', 'due_at']),
+    ('ix_presentation_course_display_at', 'presentation',
+     ['course_id', 'display_at']),
+    ('ix_submission_user_id', 'submission', ['user_id']),
+]
+
+
+def _dedupe(name):
+    # Enrolling someone twice used to add a second row. Rows without a user
+    # or course can't be keyed and never matched anyone, so they go; each
+    # duplicated pair is deleted and put back once.
+    bind = op.get_bind()
+    table = sa.table(name, sa.column('user_id', sa.Integer),
+                     sa.column('course_id', sa.Integer))
+    bind.execute(table.delete().where(sa.or_(
+        table.c.user_id == None, table.c.course_id == None)))
+    duplicated = bind.execute(sa.select(
+        [table.c.user_id, table.c.course_id]).group_by(
+        table.c.user_id, table.c.course_id).having(
+        sa.func.count() > 1)).fetchall()
+    for user_id, course_id in duplicated:
+        bind.execute(table.delete().where(sa.and_(
+            table.c.user_id == user_id, table.c.course_id == course_id)))
+        bind.execute(table.insert().values(
+            user_id=user_id, course_id=course_id))
+
+
+def upgrade():
+    for name in ENROLLMENTS:
+        _dedupe(name)
+        # SQLite can't add a primary key in place; batch mode copies the
+        # table into a new one that has it
+        with op.batch_alter_table(name) as batch_op:
+            batch_op.alter_column('user_id', existing_type=sa.Integer(),
+                                  nullable=False)
+            batch_op.alter_column('course_id', existing_type=sa.Integer(),
+                                  nullable=False)
+            batch_op.create_primary_key(
+                '%s_pkey' % name, ['user_id', 'course_id'])
+        op.create_index('ix_%s_course_user' % name, name,
+                        ['course_id', 'user_id'], unique=False)
+    for index, table, columns in INDEXES:
+        op.create_index(index, table, columns, unique=False)
+
+
+def downgrade():
+    for index, table, columns in reversed(INDEXES):
+        op.drop_index(index, table_name=table)
+    for name in reversed(ENROLLMENTS):
+        op.drop_index('ix_%s_course_user' % name, table_name=name)
+        with op.batch_alter_table(name) as batch_op:
+            batch_op.drop_constraint('%s_pkey' % name, type_='primary')
+            batch_op.alter_column('course_id', existing_type=sa.Integer(),
+                                  nullable=True)
+            batch_op.alter_column('user_id', existing_type=sa.Integer(),
+                                  nullable=True)
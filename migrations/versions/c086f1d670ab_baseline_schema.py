@@ -0,0 +1,80 @@
+"""baseline schema
+
+Revision ID: c086f1d670ab
+Revises: 
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c086f1d670ab'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=80), nullable=True),
+        sa.Column('email', sa.String(length=120), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username'))
+    op.create_table(
+        'course',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.Column('syllabus_filename', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'))
+    op.create_table(
+        'assignment',
+        sa.Column('display_at', sa.DateTime(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.Column('due_at', sa.DateTime(), nullable=False),
+        sa.Column('description', sa.String(length=1000), nullable=True),
+        sa.Column('description_filename', sa.String(), nullable=True),
+        sa.Column('course_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['course_id'], ['course.id']),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_table(
+        'presentation',
+        sa.Column('display_at', sa.DateTime(), nullable=False),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('name', sa.String(length=120), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('course_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['course_id'], ['course.id']),
+        sa.PrimaryKeyConstraint('id'))
+    for name in ('student_course_maps', 'instructor_course_maps'):
+        op.create_table(
+            name,
+            sa.Column('user_id', sa.Integer(), nullable=True),
+            sa.Column('course_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['course_id'], ['course.id']),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id']))
+    op.create_table(
+        'submission',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('submitted_at', sa.DateTime(), nullable=False),
+        sa.Column('is_official', sa.Boolean(), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('assignment_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['assignment_id'], ['assignment.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    for name in ('submission', 'instructor_course_maps',
+                 'student_course_maps', 'presentation', 'assignment',
+                 'course', 'user'):
+        op.drop_table(name)
@@ -0,0 +1,25 @@
+"""index lowercased usernames
+
+Revision ID: d494c2f7d8fb
+Revises: df1ea9b4d10a
+Create Date: 2026-10-18 16:00:05.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd494c2f7d8fb'
+down_revision = 'df1ea9b4d10a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_user_username_lower', 'user',
+                    [sa.text('lower(username)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_username_lower', table_name='user')
@@ -0,0 +1,51 @@
+"""one official submission per student
+
+Revision ID: df1ea9b4d10a
+Revises: a05f11c610b3
+Create Date: 2026-10-18 16:00:04.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'df1ea9b4d10a'
+down_revision = 'a05f11c610b3'
+branch_labels = None
+depends_on = None
+
+submission = sa.table(
+    'submission',
+    sa.column('id', sa.Integer),
+    sa.column('assignment_id', sa.Integer),
+    sa.column('user_id', sa.Integer),
+    sa.column('submitted_at', sa.DateTime),
+    sa.column('is_official', sa.Boolean))
+
+
+def upgrade():
+    op.create_index('ix_submission_assignment_user', 'submission',
+                    ['assignment_id', 'user_id'], unique=False)
+
+    # Races used to leave some students with several official submissions;
+    # keep the latest of them before the unique index forbids it.
+    other = submission.alias('other')
+    latest = sa.select([other.c.id]).where(sa.and_(
+        other.c.assignment_id == submission.c.assignment_id,
+        other.c.user_id == submission.c.user_id,
+        other.c.is_official == sa.true())).order_by(
+        other.c.submitted_at.desc(), other.c.id.desc()).limit(1).as_scalar()
+    op.execute(submission.update().where(sa.and_(
+        submission.c.is_official == sa.true(),
+        submission.c.id != latest)).values(is_official=False))
+
+    op.create_index('uq_submission_official', 'submission',
+                    ['assignment_id', 'user_id'], unique=True,
+                    postgresql_where=sa.text('is_official'),
+                    sqlite_where=sa.text('is_official'))
+
+
+def downgrade():
+    op.drop_index('uq_submission_official', table_name='submission')
+    op.drop_index('ix_submission_assignment_user', table_name='submission')
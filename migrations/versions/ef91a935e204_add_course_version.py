@@ -0,0 +1,32 @@
+"""add course version
+
+Revision ID: ef91a935e204
+Revises: 6dad5a507d1c
+Create Date: 2026-10-18 16:00:09.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ef91a935e204'
+down_revision = '6dad5a507d1c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('course',
+                  sa.Column('version', sa.Integer(), nullable=False,
+                            server_default='0'))
+
+
+def downgrade():
+    # batch mode rebuilds the table on SQLite from its reflection, which
+    # skips expression indexes; it's put back afterwards
+    op.drop_index('ix_course_name_lower', table_name='course')
+    with op.batch_alter_table('course') as batch_op:
+        batch_op.drop_column('version')
+    op.create_index('ix_course_name_lower', 'course',
+                    [sa.text('lower(name)')], unique=False)
@@ -0,0 +1,38 @@
+"""add submission receipt
+
+Revision ID: f0dd06349d98
+Revises: ef91a935e204
+Create Date: 2026-10-18 16:00:10.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0dd06349d98'
+down_revision = 'ef91a935e204'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('submission',
+                  sa.Column('receipt', sa.String(length=32), nullable=True))
+    # a unique index rather than a constraint, which SQLite can't add to an
+    # existing table; rows from before the queue have no receipt
+    op.create_index('uq_submission_receipt', 'submission', ['receipt'],
+                    unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_submission_receipt', table_name='submission')
+    # batch mode rebuilds the table on SQLite from its reflection, which
+    # loses the partial index's WHERE; it's put back as it was afterwards
+    op.drop_index('uq_submission_official', table_name='submission')
+    with op.batch_alter_table('submission') as batch_op:
+        batch_op.drop_column('receipt')
+    op.create_index('uq_submission_official', 'submission',
+                    ['assignment_id', 'user_id'], unique=True,
+                    postgresql_where=sa.text('is_official'),
+                    sqlite_where=sa.text('is_official'))
@@ -1,19 +1,65 @@
 import datetime
 
-from flask import g
+from flask import g, has_app_context
 from flask.ext.login import UserMixin
 
 from db import db
+from cache import TTLCache
+from replica import read_replica
 from utils import ldap_fetch
 import config
 
 
+user_cache = TTLCache(maxsize=config.USER_CACHE_SIZE, ttl=config.USER_CACHE_TTL)
+permission_cache = TTLCache(
+    maxsize=10000, ttl=config.UPLOAD_PERMISSION_CACHE_TTL)
+upcoming_cache = TTLCache(
+    maxsize=config.USER_CACHE_SIZE, ttl=config.UPCOMING_CACHE_TTL)
+# rendered pages of the course catalog, keyed by (search prefix, cursor)
+catalog_cache = TTLCache(maxsize=1000, ttl=config.CATALOG_CACHE_TTL)
+
+
+def invalidate_membership():
+    if has_app_context():
+        g._membership = None
+
+
+def invalidate_catalog():
+    # other workers catch up within CATALOG_CACHE_TTL
+    catalog_cache.clear()
+
+
+def invalidate_upcoming_assignments(course_id):
+    members = db.union(
+        db.select([student_course_maps.c.user_id]).where(
+            student_course_maps.c.course_id == course_id),
+        db.select([instructor_course_maps.c.user_id]).where(
+            instructor_course_maps.c.course_id == course_id))
+    for user_id, in db.session.execute(members):
+        upcoming_cache.delete(user_id)
+
+
+def bump_course_version(course_id):
+    # Part of the caller's transaction. `course_id` may also be a scalar
+    # subquery. Pages of the course get new ETags once it commits.
+    if course_id is not None:
+        course = Course.__table__
+        db.session.execute(course.update().where(
+            course.c.id == course_id).values(version=course.c.version + 1))
+
+
 class SaveMixin(object):
 
     def save(self):
         db.session.add(self)
+        db.session.flush()
+        bump_course_version(self._version_course_id())
         db.session.commit()
 
+    def _version_course_id(self):
+        # the course whose pages show this record
+        return getattr(self, 'course_id', None)
+
 
 class DisplayAtMixin(object):
 
@@ -25,16 +71,24 @@ class DisplayAtMixin(object):
 
 
 
+# The (user_id, course_id) primary key serves per-user lookups and keeps
+# enrollments unique; the reversed index serves per-course rosters.
 student_course_maps = db.Table(
     'student_course_maps',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('course_id', db.Integer, db.ForeignKey('course.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('course_id', db.Integer, db.ForeignKey('course.id'),
+              primary_key=True),
+    db.Index('ix_student_course_maps_course_user', 'course_id', 'user_id')
 )
 
 instructor_course_maps = db.Table(
     'instructor_course_maps',
-    db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-    db.Column('course_id', db.Integer, db.ForeignKey('course.id'))
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'),
+              primary_key=True),
+    db.Column('course_id', db.Integer, db.ForeignKey('course.id'),
+              primary_key=True),
+    db.Index('ix_instructor_course_maps_course_user', 'course_id', 'user_id')
 )
 
 
@@ -53,60 +107,148 @@ class User(db.Model, SaveMixin, UserMixin):
     def __init__(self, uid=None, name=None, passwd=None):
         ldapres = ldap_fetch(uid=uid, name=name, passwd=passwd)
         if ldapres is not None:
-            self.name = ldapres['name']
-            self.username = ldapres['uid']
-            self.email = ldapres['mail']
-            self.id = ldapres['id']
+            self.update_from_ldap(ldapres)
+
+    @classmethod
+    def load(cls, user_id):
+        user_id = int(user_id)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = cls.query.get(user_id)
+            if user is None:
+                return None
+            # the entry is new or has gone stale, so check back with LDAP
+            if user.refresh_from_ldap():
+                db.session.refresh(user)
+            db.session.expunge(user)
+            user_cache.set(user_id, user)
+        # the cached copy stays detached; each request gets its own instance
+        return db.session.merge(user, load=False)
+
+    def update_from_ldap(self, ldapres):
+        self.name = ldapres['name']
+        self.username = ldapres['uid']
+        self.email = ldapres['mail']
+        self.id = ldapres['id']
+
+    def refresh_from_ldap(self):
+        try:
+            ldapres = ldap_fetch(uid=self.id)
+        except Exception:
+            # an LDAP outage shouldn't take every page down with it
+            return False
+        if ldapres is None:
+            return False
+        if (self.username, self.email) == (ldapres['uid'], ldapres['mail']):
+            return False
+        self.username = ldapres['uid']
+        self.email = ldapres['mail']
+        self.save()
+        return True
 
     def get_upcoming_assignments(self):
-        assignments = []
-        for course in self.courses:
-            assignments += course.get_upcoming_assignments()
-        return assignments
+        # rows of (id, name, due_at, course_id, course_name), soonest first
+        cached = upcoming_cache.get(self.id)
+        if cached is not None:
+            return cached
+        now = datetime.datetime.now()
+        member_of = db.union(
+            db.select([student_course_maps.c.course_id]).where(
+                student_course_maps.c.user_id == self.id),
+            db.select([instructor_course_maps.c.course_id]).where(
+                instructor_course_maps.c.user_id == self.id))
+        rows = db.session.query(
+            Assignment.id, Assignment.name, Assignment.due_at,
+            Assignment.display_at, Assignment.course_id,
+            Course.name.label('course_name')
+        ).join(Course, Assignment.course_id == Course.id).filter(
+            Assignment.course_id.in_(member_of),
+            Assignment.due_at > now).order_by(Assignment.due_at).all()
+        upcoming = [row for row in rows if row.display_at <= now]
+        # expire when the first one falls due or a hidden one shows up
+        changes = [row.due_at for row in upcoming[:1]] + \
+            [row.display_at for row in rows if row.display_at > now]
+        ttl = config.UPCOMING_CACHE_TTL
+        if changes:
+            ttl = min(ttl, max((min(changes) - now).total_seconds(), 0))
+        upcoming_cache.set(self.id, upcoming, ttl)
+        return upcoming
 
     def has_permission_to_read(self, setname, filename):
-        # TODO: dry this up
-        ret = True
+        key = (self.id, setname, filename)
+        allowed = permission_cache.get(key)
+        if allowed is None:
+            allowed = self._check_permission_to_read(setname, filename)
+            permission_cache.set(key, allowed)
+        return allowed
+
+    def _check_permission_to_read(self, setname, filename):
+        # A single query per set, on the replica: deny if any record using
+        # this file is one the user may not see.
+        taking = db.select([student_course_maps.c.course_id]).where(
+            student_course_maps.c.user_id == self.id)
+        teaching = db.select([instructor_course_maps.c.course_id]).where(
+            instructor_course_maps.c.user_id == self.id)
+
+        def part_of(course_id):
+            return db.or_(course_id.in_(taking), course_id.in_(teaching))
+
         if setname == 'submissions':
-            subs = Submission.query.filter(
-                Submission.filename == filename).all()
-            for sub in subs:
-                course = sub.assignment.course
-                is_instructor = self.is_instructor_for(course)
-                ret = ret and self.is_part_of(course)
-                ret = ret and (sub.user_id == self.id or is_instructor)
+            forbidden = db.session.query(Submission.id).join(
+                Assignment, Submission.assignment_id == Assignment.id).filter(
+                Submission.filename == filename,
+                db.not_(db.and_(
+                    part_of(Assignment.course_id),
+                    db.or_(Submission.user_id == self.id,
+                           Assignment.course_id.in_(teaching)))))
         elif setname == 'presentations':
-            presentations = Presentation.query.filter(
-                Presentation.filename == filename).all()
-            for p in presentations:
-                course = p.course
-                ret = ret and self.is_part_of(course)
-                if self.is_taking(course):
-                    ret = ret and p.is_visible_to_students()
+            forbidden = db.session.query(Presentation.id).filter(
+                Presentation.filename == filename,
+                db.not_(db.and_(
+                    part_of(Presentation.course_id),
+                    db.or_(~Presentation.course_id.in_(taking),
+                           Presentation.display_at <= datetime.datetime.now()))))
         elif setname == 'syllabi':
-            courses = Course.query.filter(
-                Course.syllabus_filename == filename).all()
-            for course in courses:
-                ret = ret and self.is_part_of(course)
+            forbidden = db.session.query(Course.id).filter(
+                Course.syllabus_filename == filename,
+                db.not_(part_of(Course.id)))
         elif setname == 'assignments':
-            assignments = Assignment.query.filter(
-                Assignment.description_filename == filename).all()
-            for a in assignments:
-                course = a.course
-                ret = ret and self.is_part_of(course)
+            forbidden = db.session.query(Assignment.id).filter(
+                Assignment.description_filename == filename,
+                db.not_(part_of(Assignment.course_id)))
         else:
-            ret = False
-        return ret
-
+            return False
+        with read_replica():
+            return not db.session.query(forbidden.exists()).scalar()
+
+    def get_membership(self):
+        # (taking, teaching) sets of course ids, fetched once per request
+        if has_app_context():
+            cached = getattr(g, '_membership', None)
+            if cached is not None and cached[0] == self.id:
+                return cached[1]
+        taking, teaching = set(), set()
+        query = db.session.query(
+            student_course_maps.c.course_id, db.literal(False)
+        ).filter(student_course_maps.c.user_id == self.id).union_all(
+            db.session.query(
+                instructor_course_maps.c.course_id, db.literal(True)
+            ).filter(instructor_course_maps.c.user_id == self.id))
+        for course_id, is_instructor in query:
+            (teaching if is_instructor else taking).add(course_id)
+        membership = (taking, teaching)
+        if has_app_context():
+            g._membership = (self.id, membership)
+        return membership
 
     def is_part_of(self, course):
         return self.is_instructor_for(course) or self.is_taking(course)
 
     def is_taking(self, course):
-        return course in self.courses
+        return course is not None and course.id in self.get_membership()[0]
 
     def is_instructor_for(self, course):
-        return course in self.taught_courses
+        return course is not None and course.id in self.get_membership()[1]
 
     def is_admin(self):
         return self.username in config.ADMIN_USERNAMES
@@ -115,26 +257,102 @@ class User(db.Model, SaveMixin, UserMixin):
         return '<User %r>' % self.username
 
 
+# roster syncs match usernames case-insensitively
+db.Index('ix_user_username_lower', db.func.lower(User.username))
+
+
 class Course(db.Model, SaveMixin):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), unique=True, nullable=False)
-    syllabus_filename = db.Column(db.String)
+    syllabus_filename = db.Column(db.String, index=True)
+    # bumped on every change to the course or anything shown on its pages
+    version = db.Column(db.Integer, nullable=False, default=0,
+                        server_default='0')
     assignments = db.relationship('Assignment', backref='course')
     presentations = db.relationship('Presentation', backref='course')
 
     def get_upcoming_assignments(self):
         return self.get_visible_assignments()
 
+    def _version_course_id(self):
+        return self.id
+
+    def freshness(self):
+        # (version, latest display_at already passed, next display_at to
+        # come) over assignments and presentations, in one query
+        now = datetime.datetime.now()
+
+        def display_at(model, upcoming):
+            if upcoming:
+                aggregate, condition = db.func.min, model.display_at > now
+            else:
+                aggregate, condition = db.func.max, model.display_at <= now
+            return db.select([aggregate(model.display_at)]).where(db.and_(
+                model.course_id == self.id, condition)).as_scalar()
+
+        row = db.session.query(
+            Course.version,
+            display_at(Assignment, False), display_at(Presentation, False),
+            display_at(Assignment, True), display_at(Presentation, True)).filter(
+            Course.id == self.id).one()
+        shown = [at for at in row[1:3] if at is not None]
+        upcoming = [at for at in row[3:] if at is not None]
+        return (row[0], max(shown) if shown else None,
+                min(upcoming) if upcoming else None)
+
+    @classmethod
+    def catalog(cls, prefix=None, after=None, limit=50):
+        # (id, name, students) rows ordered case-insensitively by name,
+        # starting after the course named `after`; `prefix` is a
+        # case-insensitive name search. Both use ix_course_name_lower.
+        lower_name = db.func.lower(cls.name)
+        students = db.select([db.func.count()]).where(
+            student_course_maps.c.course_id == cls.id).as_scalar()
+        query = db.session.query(cls.id, cls.name, students.label('students'))
+        if prefix:
+            prefix = prefix.lower()
+            query = query.filter(lower_name >= prefix,
+                                 lower_name < prefix + u'\uffff')
+        if after:
+            query = query.filter(db.or_(
+                lower_name > after.lower(),
+                db.and_(lower_name == after.lower(), cls.name > after)))
+        return query.order_by(lower_name, cls.name).limit(limit).all()
+
+    def roster(self, table, after=None, limit=100):
+        # one page of (id, username) for student_course_maps or
+        # instructor_course_maps, by username, after `after`
+        query = db.session.query(User.id, User.username).join(
+            table, table.c.user_id == User.id).filter(
+            table.c.course_id == self.id)
+        if after:
+            query = query.filter(User.username > after)
+        return query.order_by(User.username).limit(limit).all()
+
     def add_assignment(self, assignment):
         assignment.course = self
 
     def add_presentation(self, presentation):
         presentation.course = self
 
+    def _member_ids(self, table, users):
+        user_ids = [user.id for user in users]
+        if not user_ids:
+            return set()
+        return set(user_id for user_id, in db.session.query(
+            table.c.user_id).filter(
+            table.c.course_id == self.id, table.c.user_id.in_(user_ids)))
+
     def add_students(self, users):
+        enrolled = self._member_ids(student_course_maps, users)
         for user in users:
+            if user.id in enrolled:
+                continue
             self.students.append(user)
+            upcoming_cache.delete(user.id)
         self.save()
+        invalidate_membership()
+        invalidate_catalog()
 
     def get_visible_presentations(self):
         return Presentation.query.filter(
@@ -149,17 +367,32 @@ class Course(db.Model, SaveMixin):
     def remove_students(self, users):
         for user in users:
             self.students.remove(user)
+            upcoming_cache.delete(user.id)
         self.save()
+        invalidate_membership()
+        invalidate_catalog()
 
     def add_instructors(self, users):
+        enrolled = self._member_ids(instructor_course_maps, users)
         for user in users:
+            if user.id in enrolled:
+                continue
             self.instructors.append(user)
+            upcoming_cache.delete(user.id)
         self.save()
+        invalidate_membership()
+        invalidate_catalog()
 
     def remove_instructors(self, users):
         for user in users:
             self.instructors.remove(user)
+            upcoming_cache.delete(user.id)
         self.save()
+        invalidate_membership()
+        invalidate_catalog()
+
+
+db.Index('ix_course_name_lower', db.func.lower(Course.name))
 
 
 class Assignment(db.Model, SaveMixin, DisplayAtMixin):
@@ -167,46 +400,158 @@ class Assignment(db.Model, SaveMixin, DisplayAtMixin):
     name = db.Column(db.String(120), nullable=False)
     due_at = db.Column(db.DateTime, nullable=False)
     description = db.Column(db.String(1000))
-    description_filename = db.Column(db.String)
+    description_filename = db.Column(db.String, index=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    # bumped when a submission's manifest is indexed; only the assignment's
+    # own page shows manifests, so the course's version is left alone
+    manifest_version = db.Column(db.Integer, nullable=False, default=0,
+                                 server_default='0')
     submissions = db.relationship('Submission', backref='assignment')
 
     def has_submission_from_user(self, user):
-        return len(self.get_submissions_from_user(user)) > 0
+        return db.session.query(self._user_submissions(user).exists()).scalar()
 
     def get_submissions_from_user(self, user):
-        # TODO: make SQL more efficient with session.query
-        return filter(lambda sub: sub.user_id == user.id, self.submissions)
+        return self._user_submissions(user).order_by(
+            Submission.submitted_at).all()
 
     def my_submissions(self):
         return self.get_submissions_from_user(g.user)
 
+    def _user_submissions(self, user):
+        return Submission.query.filter(
+            Submission.assignment_id == self.id,
+            Submission.user_id == user.id)
+
+    def _is_late(self):
+        # compared against this assignment's due date, so no join is needed
+        return (Submission.submitted_at > self.due_at).label('is_late')
+
+    def my_submissions_with_lateness(self):
+        # rows of (submission, is_late)
+        return self._user_submissions(g.user).add_columns(
+            self._is_late()).order_by(Submission.submitted_at).all()
+
+    def official_submissions(self, sort='username', descending=False):
+        # rows of (submission, username, is_late)
+        is_late = self._is_late()
+        columns = {
+            'username': User.username,
+            'submitted_at': Submission.submitted_at,
+            'late': is_late,
+        }
+        column = columns.get(sort, User.username)
+        order = [column.desc() if descending else column]
+        if column is not User.username:
+            order.append(User.username)
+        return db.session.query(Submission, User.username, is_late).join(
+            User, Submission.user_id == User.id).filter(
+            Submission.assignment_id == self.id,
+            Submission.is_official == True).order_by(*order)
+
+
+db.Index('ix_assignment_course_display_at',
+         Assignment.course_id, Assignment.display_at)
+db.Index('ix_assignment_course_due_at', Assignment.course_id, Assignment.due_at)
+
 
 class Presentation(db.Model, SaveMixin, DisplayAtMixin):
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
     name = db.Column(db.String(120), nullable=False)
-    filename = db.Column(db.String, nullable=False)
+    filename = db.Column(db.String, nullable=False, index=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
 
 
+db.Index('ix_presentation_course_display_at',
+         Presentation.course_id, Presentation.display_at)
+
+
 class Submission(db.Model, SaveMixin):
     id = db.Column(db.Integer, primary_key=True)
-    submitted_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    # the app's clock, like due_at and the ingest queue's arrival times;
+    # the database's now() is UTC on SQLite
+    submitted_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.datetime.now)
     is_official = db.Column(db.Boolean, nullable=False)
-    filename = db.Column(db.String, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String, nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+    # set by the manifest indexer: 'ok', 'empty', 'corrupt', 'unsupported'
+    # or 'missing'; NULL until the archive has been read
+    manifest_status = db.Column(db.String(16))
+    # set when the row comes from the ingest queue (see ingest.py)
+    receipt = db.Column(db.String(32))
 
     def is_late(self):
         return self.submitted_at > self.assignment.due_at
 
+    def _version_course_id(self):
+        return db.select([Assignment.course_id]).where(
+            Assignment.id == self.assignment_id).as_scalar()
+
     def officialize(self):
-        other_submissions = self.assignment.my_submissions()
-        for other in other_submissions:
-            other.is_official = False
-        self.is_official = True
-        self.save()
+        # Everything happens in one transaction. Locking the user's row makes
+        # concurrent submissions from the same student take turns, and the
+        # partial unique index below backs that up.
+        db.session.add(self)
+        db.session.query(User.id).filter(
+            User.id == self.user_id).with_for_update().one()
+        db.session.flush()
+        siblings = Submission.query.filter(
+            Submission.assignment_id == self.assignment_id,
+            Submission.user_id == self.user_id)
+        siblings.filter(
+            Submission.id != self.id, Submission.is_official == True).update(
+            {Submission.is_official: False}, synchronize_session=False)
+        siblings.filter(Submission.id == self.id).update(
+            {Submission.is_official: True}, synchronize_session=False)
+        bump_course_version(self._version_course_id())
+        db.session.commit()
 
     def __repr__(self):
         return '%r' % self.filename
+
+
+db.Index('ix_submission_assignment_user',
+         Submission.assignment_id, Submission.user_id)
+# at most one official submission per student per assignment
+db.Index('uq_submission_official',
+         Submission.assignment_id, Submission.user_id, unique=True,
+         postgresql_where=db.text('is_official'),
+         sqlite_where=db.text('is_official'))
+db.Index('uq_submission_receipt', Submission.receipt, unique=True)
+
+
+class ManifestEntry(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    submission_id = db.Column(
+        db.Integer, db.ForeignKey('submission.id'), nullable=False, index=True)
+    path = db.Column(db.String, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+
+
+class ChunkedUpload(db.Model, SaveMixin):
+    id = db.Column(db.String(32), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    filename = db.Column(db.String, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    assignment_id = db.Column(db.Integer, db.ForeignKey('assignment.id'), nullable=False)
+
+
+class Blob(db.Model):
+    digest = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+class StoredFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    setname = db.Column(db.String(40), nullable=False)
+    filename = db.Column(db.String, nullable=False)
+    blob_digest = db.Column(
+        db.String(64), db.ForeignKey('blob.digest'), nullable=False)
+    blob = db.relationship('Blob')
+    __table_args__ = (db.UniqueConstraint('setname', 'filename'),)
@@ -0,0 +1,82 @@
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, session, has_app_context, has_request_context
+from flask.ext.sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import Select, CompoundSelect, UpdateBase
+
+
+# Read-replica routing. With a 'replica' entry in SQLALCHEMY_BINDS, plain
+# SELECTs issued inside read_replica() (or a view decorated with
+# replica_reads) go to the replica; everything else, including SELECT ... FOR
+# UPDATE and anything after the request has written, stays on the primary.
+# A user who just wrote reads from the primary for REPLICA_LAG_SECONDS so the
+# redirect after a POST shows their change.
+
+def _reading_from_replica():
+    if not has_app_context() or not getattr(g, '_read_replica', False):
+        return False
+    if getattr(g, '_database_written', False):
+        return False
+    return not (has_request_context() and
+                session.get('_primary_until', 0) > time.time())
+
+
+def _mark_written():
+    if has_app_context():
+        g._database_written = True
+
+
+class RoutingSession(SignallingSession):
+
+    def __init__(self, db, **options):
+        SignallingSession.__init__(self, db, **options)
+        self.replica = None
+        if 'replica' in (self.app.config['SQLALCHEMY_BINDS'] or {}):
+            self.replica = db.get_engine(self.app, bind='replica')
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            _mark_written()
+        elif (self.replica is not None and _reading_from_replica() and
+                isinstance(clause, (Select, CompoundSelect)) and
+                getattr(clause, '_for_update_arg', None) is None):
+            return self.replica
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@contextmanager
+def read_replica():
+    previous = getattr(g, '_read_replica', False)
+    g._read_replica = True
+    try:
+        yield
+    finally:
+        g._read_replica = previous
+
+
+def replica_reads(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with read_replica():
+            return f(*args, **kwargs)
+    return decorated_function
+
+
+def init_app(app):
+
+    @app.after_request
+    def stick_to_primary(response):
+        if getattr(g, '_database_written', False) and \
+                'replica' in (app.config['SQLALCHEMY_BINDS'] or {}):
+            session['_primary_until'] = \
+                time.time() + app.config['REPLICA_LAG_SECONDS']
+        return response
@@ -0,0 +1,137 @@
+import csv
+
+from db import app, db
+from models import User, student_course_maps, instructor_course_maps, \
+    bump_course_version, invalidate_catalog, invalidate_membership, \
+    upcoming_cache, user_cache
+from utils import chunks, ldap_fetch_many
+
+
+ROLES = {
+    'students': student_course_maps,
+    'instructors': instructor_course_maps,
+}
+
+# keeps IN (...) lists under SQLite's bound parameter limit
+BATCH_SIZE = 500
+
+
+class RosterError(Exception):
+    pass
+
+
+class RemovalsNeedConfirming(RosterError):
+
+    def __init__(self, removed):
+        RosterError.__init__(
+            self, 'the roster would remove %d members' % len(removed))
+        self.removed = removed
+
+
+def parse_usernames(lines):
+    # first column of a CSV export, or one username per line
+    usernames = []
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        name = row[0].strip()
+        if name and name.lower() != 'username':
+            usernames.append(name)
+    return usernames
+
+
+# Usernames are matched case-insensitively; an export that says JSmith means
+# the jsmith who logged in last term.
+
+def _user_ids(usernames):
+    # lowercased username -> id
+    ids = {}
+    for batch in chunks([name.lower() for name in usernames], BATCH_SIZE):
+        ids.update(db.session.query(
+            db.func.lower(User.username), User.id).filter(
+            db.func.lower(User.username).in_(batch)))
+    return ids
+
+
+def _provision(usernames):
+    entries = ldap_fetch_many(usernames)
+    # LDAP may answer with a spelling of the uid that already has a row
+    existing = _user_ids(entries)
+    new = dict((int(entry['id']), entry) for entry in entries.values()
+               if entry['uid'].lower() not in existing)
+    # a uidNumber that already has a row belongs to someone who was renamed
+    renamed = set()
+    for batch in chunks(list(new), BATCH_SIZE):
+        renamed.update(user_id for user_id, in db.session.query(
+            User.id).filter(User.id.in_(batch)))
+    rows = []
+    for user_id, entry in new.items():
+        existing[entry['uid'].lower()] = user_id
+        if user_id in renamed:
+            User.query.filter_by(id=user_id).update(
+                {User.username: entry['uid'], User.email: entry['mail']},
+                synchronize_session=False)
+            user_cache.delete(user_id)
+        else:
+            rows.append({'id': user_id, 'username': entry['uid'],
+                         'email': entry['mail']})
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+    return existing
+
+
+def sync_roster(course, usernames, role='students', confirmed=False):
+    # Makes the course's student or instructor list match `usernames`
+    # exactly, creating User rows from LDAP for anyone who hasn't logged in
+    # yet. Returns the added, removed and unknown usernames. An empty list is
+    # refused, and removing more than ROSTER_CONFIRM_REMOVALS members raises
+    # RemovalsNeedConfirming unless `confirmed`; nothing changes either way.
+    if not usernames:
+        raise RosterError('the roster lists no usernames')
+    table = ROLES[role]
+    # lowercased -> the spelling the roster used
+    wanted = {}
+    for name in usernames:
+        wanted.setdefault(name.lower(), name)
+
+    current = dict(db.session.query(User.id, User.username).join(
+        table, table.c.user_id == User.id).filter(
+        table.c.course_id == course.id))
+    leaving = sorted(username for username in current.values()
+                     if username.lower() not in wanted)
+    if len(leaving) > app.config['ROSTER_CONFIRM_REMOVALS'] and not confirmed:
+        raise RemovalsNeedConfirming(leaving)
+
+    ids = _user_ids(wanted)
+    missing = [wanted[name] for name in wanted if name not in ids]
+    if missing:
+        ids.update(_provision(missing))
+    unknown = [wanted[name] for name in wanted if name not in ids]
+
+    target = set(ids.values())
+    added = target - set(current)
+    removed = set(current) - target
+
+    if added:
+        db.session.execute(table.insert(), [
+            {'user_id': user_id, 'course_id': course.id}
+            for user_id in added])
+    for batch in chunks(removed, BATCH_SIZE):
+        db.session.execute(table.delete().where(db.and_(
+            table.c.course_id == course.id, table.c.user_id.in_(batch))))
+    if added or removed:
+        bump_course_version(course.id)
+    db.session.commit()
+
+    for user_id in added | removed:
+        upcoming_cache.delete(user_id)
+    invalidate_membership()
+    invalidate_catalog()
+
+    names_by_id = dict((user_id, wanted.get(name, name))
+                       for name, user_id in ids.items())
+    return {
+        'added': sorted(names_by_id[user_id] for user_id in added),
+        'removed': sorted(current[user_id] for user_id in removed),
+        'unknown': sorted(unknown),
+    }
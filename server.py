@@ -1,35 +1,47 @@
+import os
+import time
+
 from flask import render_template, request, redirect, url_for, g, Blueprint, \
-    abort, current_app, send_from_directory
+    abort, current_app, jsonify, Response, Markup, stream_with_context
+from flask.ext.uploads import extension
 from flask.ext.login import LoginManager, login_user, \
     login_required, logout_user, current_user
 from dateutil.parser import parse
 
-from models import User, Course, Assignment, Submission, Presentation
-from uploads import submissions, presentations, syllabi, assignment_descs
+from models import User, Course, Assignment, Submission, Presentation, \
+    ChunkedUpload, StoredFile, student_course_maps, instructor_course_maps, \
+    user_cache, catalog_cache, upcoming_cache, bump_course_version, \
+    invalidate_catalog, invalidate_upcoming_assignments
+from uploads import submissions, presentations, syllabi, assignment_descs, \
+    send_upload
 from db import app, db
+from replica import replica_reads
+import chunked
+import cleanup
+import gradebook
+import ingest
+import manifests
+import metrics
+import roster
+import storage
+from zipstream import zip_stream
 from forms import LoginForm
 from decorators import admin_required, instructor_required, \
-    course_membership_required
+    course_membership_required, versioned_page
 
 
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 
 
-
 @login_manager.user_loader
 def load_user(userid):
-    return User(uid=userid)
+    return User.load(userid)
 
 
 @app.before_request
 def before_request():
-    g.user = current_user
-    if current_user.is_authenticated():
-        user = User.query.get(current_user.id)
-        if user:
-            g.user = user
+    g.user = current_user._get_current_object()
 
 
 
@@ -52,6 +64,7 @@ def login():
             user = User(name=form.username.data, passwd=form.password.data)
         if user.username and user.email:
             user.save()
+            user_cache.delete(user.id)
             login_user(user)
             return redirect(next_url or url_for("home"))
     return render_template('login.html')
@@ -66,9 +79,24 @@ def logout():
 
 
 @app.route('/courses')
+@replica_reads
 @login_required
 def list_courses():
-    return render_template('course/list.html', courses=Course.query.all())
+    prefix = request.args.get('q', '').strip()
+    after = request.args.get('after', None)
+    key = (prefix, after)
+    catalog = catalog_cache.get(key)
+    if catalog is None:
+        page_size = app.config['CATALOG_PAGE_SIZE']
+        courses = Course.catalog(prefix, after, page_size + 1)
+        next_after = courses[page_size - 1].name \
+            if len(courses) > page_size else None
+        catalog = render_template(
+            'course/catalog.html', courses=courses[:page_size],
+            prefix=prefix, next_after=next_after)
+        catalog_cache.set(key, catalog)
+    return render_template(
+        'course/list.html', catalog=Markup(catalog), prefix=prefix)
 
 
 @app.route('/courses/new', methods=["GET", "POST"])
@@ -79,43 +107,88 @@ def new_course():
         name = request.form.get('name', None)
         syllabus = request.files.get('syllabus', None)
         if name and syllabus:
-            filename = syllabi.save(syllabus)
+            filename = storage.save(syllabi, syllabus)
             course = Course(name=name, syllabus_filename=filename)
             db.session.add(course)
             db.session.commit()
+            invalidate_catalog()
             return redirect(url_for('list_courses'))
     return render_template('course/new.html')
 
 
 @app.route('/courses/<course_id>')
+@replica_reads
 @login_required
+@versioned_page()
 def view_course(course_id):
+    course = g.course
+    page_size = app.config['ROSTER_PAGE_SIZE']
+
+    def roster_page(table, after):
+        users = course.roster(table, after, page_size + 1)
+        next_after = users[page_size - 1].username \
+            if len(users) > page_size else None
+        return users[:page_size], next_after
+
+    students = instructors = (None, None)
+    if g.user.is_instructor_for(course):
+        students = roster_page(
+            student_course_maps, request.args.get('students_after'))
+    if g.user.is_admin():
+        instructors = roster_page(
+            instructor_course_maps, request.args.get('instructors_after'))
     return render_template(
         'course/view.html',
-        course=Course.query.get(course_id))
+        course=course,
+        students=students[0],
+        next_students=students[1],
+        instructors=instructors[0],
+        next_instructors=instructors[1])
 
 
 @app.route('/courses/<course_id>/edit', methods=["POST"])
 @login_required
 @instructor_required
 def edit_course(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     name = request.form.get('name', None)
     syllabus = request.files.get('syllabus', None)
     if name:
         course.name = name
     if syllabus:
-        filename = syllabi.save(syllabus)
+        filename = storage.save(syllabi, syllabus)
+        storage.release('syllabi', course.syllabus_filename)
         course.syllabus_filename = filename
     course.save()
+    invalidate_catalog()
     return redirect(url_for('view_course', course_id=course_id))
 
 
+@app.route('/courses/<course_id>/delete', methods=["GET", "POST"])
+@login_required
+@admin_required
+def delete_course(course_id):
+    course = Course.query.get_or_404(course_id)
+    if request.method != 'POST':
+        return render_template('course/delete.html', course=course)
+    # the admin types the course's name to confirm
+    if request.form.get('name', '').strip() != course.name:
+        return render_template(
+            'course/delete.html', course=course, mismatch=True), 400
+    cleanup.delete_course(course.id)
+    db.session.commit()
+    invalidate_catalog()
+    # the former members' dashboards
+    upcoming_cache.clear()
+    cleanup.schedule_sweep()
+    return redirect(url_for('list_courses'))
+
+
 @app.route('/courses/<course_id>/syllabus')
 @login_required
 @course_membership_required
 def get_course_syllabus(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     if not course.syllabus_filename:
         return redirect(url_for('view_course', course_id=course_id))
     return redirect(syllabi.url(course.syllabus_filename))
@@ -125,7 +198,7 @@ def get_course_syllabus(course_id):
 @login_required
 @instructor_required
 def course_add_students(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     usernames = request.form.get('usernames', '').split('\n')
     users = User.query.filter(User.username.in_(usernames)).all()
     course.add_students(users)
@@ -136,7 +209,7 @@ def course_add_students(course_id):
 @app.route('/courses/<course_id>/remove_students', methods=["POST"])
 @instructor_required
 def course_remove_students(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     usernames = request.form.get('usernames', '').split('\n')
     users = User.query.filter(User.username.in_(usernames)).all()
     course.remove_students(users)
@@ -148,7 +221,7 @@ def course_remove_students(course_id):
 @login_required
 @admin_required
 def course_add_instructors(course_id):
-    course = Course.query.get(course_id)
+    course = Course.query.get_or_404(course_id)
     usernames = request.form.get('usernames', '').split('\n')
     users = User.query.filter(User.username.in_(usernames)).all()
     course.add_instructors(users)
@@ -160,7 +233,7 @@ def course_add_instructors(course_id):
 @login_required
 @admin_required
 def course_remove_instructors(course_id):
-    course = Course.query.get(course_id)
+    course = Course.query.get_or_404(course_id)
     usernames = request.form.get('usernames', '').split('\n')
     users = User.query.filter(User.username.in_(usernames)).all()
     course.remove_instructors(users)
@@ -168,19 +241,68 @@ def course_remove_instructors(course_id):
     return redirect(url_for('view_course', course_id=course_id))
 
 
+@app.route('/courses/<course_id>/roster', methods=["POST"])
+@login_required
+def sync_course_roster(course_id):
+    course = Course.query.get_or_404(course_id)
+    role = request.form.get('role', 'students')
+    if role not in roster.ROLES:
+        abort(400)
+    if not (g.user.is_admin() or
+            (role == 'students' and g.user.is_instructor_for(course))):
+        return redirect(url_for('home'))
+    csv_file = request.files.get('roster', None)
+    if csv_file:
+        lines = csv_file.stream
+    else:
+        lines = request.form.get('usernames', '').splitlines()
+    usernames = roster.parse_usernames(lines)
+    confirmed = request.form.get('confirm') == 'yes'
+    try:
+        diff = roster.sync_roster(course, usernames, role, confirmed)
+    except roster.RemovalsNeedConfirming as e:
+        return render_template(
+            'course/roster.html', course=course, role=role,
+            usernames=usernames, removed=e.removed)
+    except roster.RosterError as e:
+        return render_template(
+            'course/roster.html', course=course, role=role, error=str(e)), 400
+    return render_template(
+        'course/roster.html', course=course, role=role, diff=diff)
+
+
 @app.route('/courses/<course_id>/assignments')
+@replica_reads
 @login_required
 @course_membership_required
+@versioned_page()
 def list_assignments(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     return render_template('assignment/list.html', course=course)
 
 
+@app.route('/courses/<course_id>/gradebook.<format>')
+@login_required
+@instructor_required
+def export_gradebook(course_id, format):
+    course = g.course
+    if format == 'csv':
+        lines, mimetype = gradebook.csv_lines(course), 'text/csv'
+    elif format == 'jsonl':
+        lines, mimetype = gradebook.json_lines(course), 'application/x-ndjson'
+    else:
+        abort(404)
+    response = Response(stream_with_context(lines), mimetype=mimetype)
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="course-%s-gradebook.%s"' % (course.id, format)
+    return response
+
+
 @app.route('/courses/<course_id>/assignments/new', methods=["GET", "POST"])
 @login_required
 @instructor_required
 def new_assignment(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     if request.method == "POST":
         name = request.form.get('name', None)
         description = request.form.get('description', None)
@@ -192,36 +314,99 @@ def new_assignment(course_id):
             assignment.due_at = parse(due_at)
             assignment.display_at = parse(display_at)
             if file_:
-                filename = assignment_descs.save(file_)
+                filename = storage.save(assignment_descs, file_)
                 assignment.description_filename = filename
             course.add_assignment(assignment)
             assignment.save()
+            invalidate_upcoming_assignments(course.id)
             return redirect(url_for('list_assignments', course_id=course_id))
     return render_template('assignment/new.html', course=course)
 
 
+def _assignment_page_marker():
+    # what the page shows that changes without moving the course's version:
+    # indexed manifests, and uploads still waiting in the ingest queue
+    pending = []
+    if app.config['SUBMISSION_INGEST']:
+        pending = ingest.pending_receipts(g.user, g.assignment)
+    return '%s:%s' % (g.assignment.manifest_version, ','.join(pending))
+
+
 @app.route('/assignments/<assignment_id>')
+@replica_reads
 @login_required
 @course_membership_required
+@versioned_page(expires=False, extra=_assignment_page_marker)
 def view_assignment(assignment_id):
-    assignment = Assignment.query.get(assignment_id)
+    assignment = g.assignment
+    course = g.course
     if assignment.description_filename:
         url = assignment_descs.url(assignment.description_filename)
     else:
         url = None
+    sort = request.args.get('sort', 'username')
+    descending = request.args.get('order') == 'desc'
+    if g.user.is_instructor_for(course):
+        official = assignment.official_submissions(sort, descending).paginate(
+            request.args.get('page', 1, type=int),
+            app.config['SUBMISSIONS_PER_PAGE'], False)
+        mine = None
+        shown = [submission.id for submission, _, _ in official.items]
+    else:
+        official = None
+        mine = assignment.my_submissions_with_lateness()
+        shown = [submission.id for submission, _ in mine]
+    received = None
+    if app.config['SUBMISSION_INGEST'] and mine is not None:
+        received = ingest.pending_for(g.user, assignment)
     return render_template(
         'assignment/view.html',
         submissions=submissions,
-        course=assignment.course,
+        course=course,
         assignment=assignment,
+        official=official,
+        mine=mine,
+        manifests=manifests.entries_for(shown),
+        received=received,
+        sort=sort,
+        descending=descending,
         url=url)
 
 
+@app.route('/assignments/<assignment_id>/submissions.zip')
+@login_required
+@instructor_required
+def download_submissions(assignment_id):
+    assignment = g.assignment
+    rows = assignment.official_submissions().outerjoin(
+        StoredFile, db.and_(
+            StoredFile.setname == submissions.name,
+            StoredFile.filename == Submission.filename)).add_columns(
+        StoredFile.blob_digest).all()
+
+    def entries():
+        for submission, username, is_late, digest in rows:
+            path = storage.path_for_digest(
+                submissions.name, submission.filename, digest)
+            if not os.path.isfile(path):
+                continue
+            folder = username + ('-LATE' if is_late else '')
+            yield (u'%s/%s' % (folder, submission.filename), path,
+                   time.mktime(submission.submitted_at.timetuple()))
+
+    response = Response(
+        stream_with_context(zip_stream(entries())),
+        mimetype='application/zip')
+    response.headers['Content-Disposition'] = \
+        'attachment; filename="assignment-%s-submissions.zip"' % assignment.id
+    return response
+
+
 @app.route('/assignments/<assignment_id>/edit', methods=["GET", "POST"])
 @login_required
 @instructor_required
 def edit_assignment(assignment_id):
-    assignment = Assignment.query.get(assignment_id)
+    assignment = g.assignment
     if request.method == "POST":
         name = request.form.get('name', None)
         due_at = request.form.get('due-at', None)
@@ -234,8 +419,11 @@ def edit_assignment(assignment_id):
         if display_at:
             assignment.display_at = parse(display_at)
         if file_:
-            assignment.filename = assignments.save(file_)
+            filename = storage.save(assignment_descs, file_)
+            storage.release('assignments', assignment.description_filename)
+            assignment.description_filename = filename
         assignment.save()
+        invalidate_upcoming_assignments(assignment.course_id)
         return redirect(
             url_for('list_assignments', course_id=assignment.course_id))
     return render_template('assignment/edit.html', assignment=assignment)
@@ -245,36 +433,132 @@ def edit_assignment(assignment_id):
 @login_required
 @instructor_required
 def delete_assignment(assignment_id):
-    assignment = Assignment.query.get(assignment_id)
-    db.session.delete(assignment)
+    course_id = g.assignment.course_id
+    cleanup.delete_assignments(Assignment.id == g.assignment.id)
+    bump_course_version(course_id)
     db.session.commit()
-    return redirect(
-        url_for('list_assignments', course_id=assignment.course_id))
+    invalidate_upcoming_assignments(course_id)
+    cleanup.schedule_sweep()
+    return redirect(url_for('list_assignments', course_id=course_id))
 
 
 @app.route('/assignments/<assignment_id>/submissions/new', methods=["POST"])
 @login_required
 @course_membership_required
 def new_submission(assignment_id):
-    assignment = Assignment.query.get(assignment_id)
+    if request.method == 'POST' and 'file' in request.files and \
+            app.config['SUBMISSION_INGEST']:
+        receipt, received_at = ingest.enqueue(
+            g.user, g.assignment, request.files['file'])
+        response = redirect(url_for(
+            'view_assignment', assignment_id=assignment_id, received=receipt))
+        response.headers['X-Submission-Receipt'] = receipt
+        response.headers['X-Received-At'] = received_at.isoformat()
+        return response
     if request.method == 'POST' and 'file' in request.files:
-        filename = submissions.save(request.files['file'])
+        filename = storage.save(submissions, request.files['file'])
         rec = Submission(
             filename=filename,
             is_official=False,
             assignment_id=assignment_id,
             user_id=g.user.id)
-        rec.save()
         rec.officialize()
+        manifests.schedule(rec)
     return redirect(url_for('view_assignment', assignment_id=assignment_id))
 
 
+def chunked_upload_json(upload, status=200):
+    response = jsonify(
+        id=upload.id,
+        filename=upload.filename,
+        size=upload.size,
+        offset=upload.received,
+        chunk_size=app.config['UPLOADS_CHUNK_SIZE'])
+    response.status_code = status
+    return response
+
+
+def get_own_chunked_upload(upload_id):
+    upload = ChunkedUpload.query.get(upload_id)
+    if upload is None:
+        abort(404)
+    if upload.user_id != g.user.id:
+        abort(403)
+    return upload
+
+
+@app.route('/assignments/<assignment_id>/chunked_uploads', methods=["POST"])
+@login_required
+@course_membership_required
+def new_chunked_upload(assignment_id):
+    assignment = g.assignment
+    filename = request.form.get('filename', '')
+    size = request.form.get('size', type=int)
+    if size is None or size < 0 or \
+            not submissions.extension_allowed(extension(filename)):
+        abort(400)
+    upload = chunked.start(g.user, assignment, filename, size)
+    return chunked_upload_json(upload, 201)
+
+
+@app.route('/chunked_uploads/<upload_id>')
+@login_required
+def show_chunked_upload(upload_id):
+    return chunked_upload_json(get_own_chunked_upload(upload_id))
+
+
+@app.route('/chunked_uploads/<upload_id>', methods=["PUT"])
+@login_required
+def append_chunked_upload(upload_id):
+    upload = get_own_chunked_upload(upload_id)
+    offset = request.args.get('offset', type=int)
+    length = request.content_length
+    if offset is None or length is None:
+        abort(400)
+    try:
+        chunked.append(upload, offset, request.stream, length,
+                       request.headers.get('X-Chunk-SHA256'))
+    except chunked.ChunkError as e:
+        response = chunked_upload_json(upload, e.status)
+        response.headers['X-Error'] = str(e)
+        return response
+    return chunked_upload_json(upload)
+
+
+@app.route('/chunked_uploads/<upload_id>/complete', methods=["POST"])
+@login_required
+def complete_chunked_upload(upload_id):
+    upload = get_own_chunked_upload(upload_id)
+    try:
+        filename = chunked.finish(upload, submissions)
+    except chunked.ChunkError as e:
+        response = chunked_upload_json(upload, e.status)
+        response.headers['X-Error'] = str(e)
+        return response
+    rec = Submission(
+        filename=filename,
+        is_official=False,
+        assignment_id=upload.assignment_id,
+        user_id=g.user.id)
+    rec.officialize()
+    manifests.schedule(rec)
+    return jsonify(submission_id=rec.id, filename=rec.filename)
+
+
+@app.route('/chunked_uploads/<upload_id>', methods=["DELETE"])
+@login_required
+def delete_chunked_upload(upload_id):
+    chunked.discard(get_own_chunked_upload(upload_id))
+    db.session.commit()
+    return '', 204
+
+
 @app.route('/submissions/<submission_id>/officialize')
 @login_required
 @course_membership_required
 def officialize_submission(submission_id):
-    submission = Submission.query.get(submission_id)
-    if submission.user == g.user:
+    submission = g.submission
+    if submission.user_id == g.user.id:
         submission.officialize()
         return redirect(
             url_for('view_assignment', assignment_id=submission.assignment_id))
@@ -283,10 +567,12 @@ def officialize_submission(submission_id):
 
 
 @app.route('/courses/<course_id>/presentations')
+@replica_reads
 @login_required
 @course_membership_required
+@versioned_page()
 def list_presentations(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     return render_template(
         'presentation/list.html', course=course, presentations=presentations)
 
@@ -296,19 +582,18 @@ def list_presentations(course_id):
 @instructor_required
 @course_membership_required
 def new_presentation(course_id):
-    course = Course.query.get(course_id)
+    course = g.course
     if request.method == "POST":
         name = request.form.get('name', None)
         display_at = request.form.get('display-at', None)
         file_ = request.files.get('file', None)
         if name and display_at and file_:
-            filename = presentations.save(file_)
+            filename = storage.save(presentations, file_)
             presentation = Presentation(
                 name=name, filename=filename, course_id=course.id)
             presentation.display_at = parse(display_at)
             course.add_presentation(presentation)
-            db.session.add(presentation)
-            db.session.commit()
+            presentation.save()
             return redirect(url_for('list_presentations', course_id=course_id))
     return render_template('presentation/new.html', course=course)
 
@@ -317,7 +602,7 @@ def new_presentation(course_id):
 @login_required
 @instructor_required
 def edit_presentation(presentation_id):
-    presentation = Presentation.query.get(presentation_id)
+    presentation = g.presentation
     if request.method == "POST":
         name = request.form.get('name', None)
         display_at = request.form.get('display-at', None)
@@ -327,7 +612,9 @@ def edit_presentation(presentation_id):
         if display_at:
             presentation.display_at = parse(display_at)
         if file_:
-            presentation.filename = presentations.save(file_)
+            filename = storage.save(presentations, file_)
+            storage.release('presentations', presentation.filename)
+            presentation.filename = filename
         presentation.save()
         return redirect(
             url_for('list_presentations', course_id=presentation.course_id))
@@ -338,11 +625,19 @@ def edit_presentation(presentation_id):
 @login_required
 @instructor_required
 def delete_presentation(presentation_id):
-    presentation = Presentation.query.get(presentation_id)
-    db.session.delete(presentation)
+    course_id = g.presentation.course_id
+    cleanup.delete_presentations(Presentation.id == g.presentation.id)
+    bump_course_version(course_id)
     db.session.commit()
-    return redirect(
-        url_for('list_presentations', course_id=presentation.course_id))
+    cleanup.schedule_sweep()
+    return redirect(url_for('list_presentations', course_id=course_id))
+
+
+@app.route('/metrics')
+@login_required
+@admin_required
+def show_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain')
 
 
 uploads = Blueprint('uploads', __name__, url_prefix='/uploads')
@@ -350,15 +645,10 @@ uploads = Blueprint('uploads', __name__, url_prefix='/uploads')
 @uploads.route('/<setname>/<path:filename>')
 @login_required
 def show(setname, filename):
-    config = current_app.upload_set_config.get(setname)
-    if config is None:
+    if setname not in current_app.upload_set_config:
         abort(404)
     if g.user.has_permission_to_read(setname, filename):
-        return send_from_directory(config.destination, filename)
+        return send_upload(filename, storage.path_for(setname, filename))
     else:
         abort(403)
 app.register_blueprint(uploads)
-
-
-if __name__ == '__main__':
-    app.run('0.0.0.0', debug=True, ssl_context='adhoc')
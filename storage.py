@@ -0,0 +1,191 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+from flask import current_app, safe_join
+from flask.ext.uploads import UploadNotAllowed, extension
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from db import app, db
+from models import Blob, StoredFile
+
+
+# Uploads are stored once per distinct content under UPLOADS_BLOB_DEST, named
+# by their SHA-256. The filename columns on the models keep their per-set
+# names, which StoredFile maps onto the shared blob.
+
+CHUNK_SIZE = 64 * 1024
+NAME_ATTEMPTS = 5
+
+
+def blob_path(digest):
+    return os.path.join(app.config['UPLOADS_BLOB_DEST'], digest[:2], digest[2:])
+
+
+def spool(stream):
+    # copies `stream` into a temp file beside the blobs, hashing it on the way
+    # and syncing it to disk; returns (digest, size, temp path)
+    dest = app.config['UPLOADS_BLOB_DEST']
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=dest, prefix='.upload-')
+    with os.fdopen(fd, 'wb') as f:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    return sha.hexdigest(), size, tmp
+
+
+def _legacy_path(setname, filename):
+    config = current_app.upload_set_config.get(setname)
+    return safe_join(config.destination, filename)
+
+
+def _suffixed(setname, basename):
+    name, ext = os.path.splitext(basename)
+    while True:
+        candidate = '%s_%s%s' % (name, uuid.uuid4().hex[:8], ext)
+        if not os.path.exists(_legacy_path(setname, candidate)):
+            return candidate
+
+
+def _free_name(setname, basename):
+    # the upload's own name if it's free, else one with a random suffix, so a
+    # popular name costs one query however many uploads already share it
+    if (os.path.exists(_legacy_path(setname, basename)) or
+            StoredFile.query.filter_by(
+                setname=setname, filename=basename).count() > 0):
+        return _suffixed(setname, basename)
+    return basename
+
+
+def _add_stored_file(setname, basename, digest):
+    filename = _free_name(setname, basename)
+    for attempt in range(NAME_ATTEMPTS):
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredFile(
+                    setname=setname, filename=filename, blob_digest=digest))
+            return filename
+        except IntegrityError:
+            if attempt == NAME_ATTEMPTS - 1:
+                raise
+            # a concurrent upload took the name since we looked
+            filename = _suffixed(setname, basename)
+
+
+def _store(setname, tmp, digest, size, basename):
+    path = blob_path(digest)
+    # Take the reference before looking at the file. collect_garbage removes
+    # a blob's file before committing its row's deletion, so once this UPDATE
+    # has matched the row the file stays put; if it matched nothing the blob
+    # is new or was just collected, and is stored afresh.
+    reused = Blob.query.filter_by(digest=digest).update(
+        {Blob.refcount: Blob.refcount + 1}, synchronize_session=False)
+    if reused == 1 and os.path.exists(path):
+        os.remove(tmp)
+    else:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        shutil.move(tmp, path)
+        if reused != 1:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Blob(digest=digest, size=size, refcount=1))
+            except IntegrityError:
+                # someone else stored the same content first
+                Blob.query.filter_by(digest=digest).update(
+                    {Blob.refcount: Blob.refcount + 1},
+                    synchronize_session=False)
+
+    # the new rows are committed along with the caller's model
+    return _add_stored_file(setname, basename, digest)
+
+
+def save(upload_set, storage, name=None):
+    basename = secure_filename(name or storage.filename)
+    if not upload_set.file_allowed(storage, basename):
+        raise UploadNotAllowed()
+    digest, size, tmp = spool(storage.stream)
+    return _store(upload_set.name, tmp, digest, size, basename)
+
+
+def save_file(upload_set, tmp, name, digest, size):
+    # takes ownership of an already hashed file, e.g. an assembled chunked
+    # upload; `tmp` is moved into the blob store or removed
+    basename = secure_filename(name)
+    if not upload_set.extension_allowed(extension(basename)):
+        os.remove(tmp)
+        raise UploadNotAllowed()
+    return _store(upload_set.name, tmp, digest, size, basename)
+
+
+def path_for_digest(setname, filename, digest):
+    # for callers that already joined StoredFile to find the digest
+    if digest is not None:
+        return blob_path(digest)
+    return _legacy_path(setname, filename)
+
+
+def path_for(setname, filename):
+    stored = StoredFile.query.filter_by(
+        setname=setname, filename=filename).first()
+    if stored is not None:
+        return blob_path(stored.blob_digest)
+    return _legacy_path(setname, filename)
+
+
+def release(setname, filename):
+    if not filename:
+        return
+    stored = StoredFile.query.filter_by(
+        setname=setname, filename=filename).first()
+    if stored is None:
+        return
+    Blob.query.filter_by(digest=stored.blob_digest).update(
+        {Blob.refcount: Blob.refcount - 1}, synchronize_session=False)
+    db.session.delete(stored)
+
+
+def release_all(setname, filenames):
+    # set-based release(); `filenames` is a list or a SELECT of filename
+    # column values, to be run before the rows it selects from are deleted
+    blobs = Blob.__table__
+    stored = StoredFile.__table__
+    matched = db.and_(stored.c.setname == setname,
+                      stored.c.filename.in_(filenames))
+    released = db.select([db.func.count()]).where(db.and_(
+        matched, stored.c.blob_digest == blobs.c.digest)).as_scalar()
+    db.session.execute(blobs.update().where(blobs.c.digest.in_(
+        db.select([stored.c.blob_digest]).where(matched))).values(
+        refcount=blobs.c.refcount - released))
+    db.session.execute(stored.delete().where(matched))
+
+
+def collect_garbage():
+    orphans = [digest for digest, in
+               db.session.query(Blob.digest).filter(Blob.refcount <= 0)]
+    for digest in orphans:
+        # re-check the count so a blob that was just reused survives; the
+        # file goes while the row's deletion still holds it, so an upload
+        # of the same content waits for the commit and then stores it anew
+        deleted = Blob.query.filter(
+            Blob.digest == digest, Blob.refcount <= 0).delete(
+            synchronize_session=False)
+        if deleted:
+            try:
+                os.remove(blob_path(digest))
+            except OSError:
+                pass
+    db.session.commit()
@@ -0,0 +1,164 @@
+import collections
+import datetime
+import hashlib
+import os
+import random
+
+from db import db
+from models import User, Course, Assignment, Submission, Presentation, \
+    Blob, StoredFile, student_course_maps, instructor_course_maps
+from utils import chunks
+import storage
+
+
+# Builds a realistic, reproducible dataset straight into the database, without
+# LDAP. Used by the query budget check and the load test. It drops every table
+# first, so only point it at a scratch database. Every filename gets a
+# StoredFile row backed by one of a small pool of blob files, so downloads
+# find real bytes.
+
+BATCH_SIZE = 5000
+
+
+def _insert(table, rows):
+    for batch in chunks(rows, BATCH_SIZE):
+        db.session.execute(table.insert(), batch)
+
+
+def _write_blobs(count):
+    # {digest: size} of `count` small distinct files in the blob store
+    sizes = {}
+    for i in range(count):
+        content = ('synthetic upload %d\n' % i).encode('ascii')
+        digest = hashlib.sha256(content).hexdigest()
+        path = storage.blob_path(digest)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(content)
+        sizes[digest] = len(content)
+    return sizes
+
+
+def build(courses=50, users=2000, assignments=500, submissions=50000,
+          presentations_per_course=5, courses_per_student=3,
+          admin_usernames=(), blobs=100, seed=0):
+    rng = random.Random(seed)
+    now = datetime.datetime.now().replace(microsecond=0)
+    db.drop_all()
+    db.create_all()
+
+    user_rows = []
+    for i, username in enumerate(admin_usernames):
+        user_rows.append({'id': i + 1, 'username': username,
+                          'email': '%s@example.edu' % username})
+    for i in range(len(user_rows), users):
+        username = 'user%05d' % (i + 1)
+        user_rows.append({'id': i + 1, 'username': username,
+                          'email': '%s@example.edu' % username})
+    _insert(User.__table__, user_rows)
+    user_ids = [row['id'] for row in user_rows[len(admin_usernames):]]
+
+    course_ids = range(1, courses + 1)
+    _insert(Course.__table__, [
+        {'id': course_id, 'name': 'COURSE %04d' % course_id,
+         'syllabus_filename': 'syllabus-%04d.pdf' % course_id}
+        for course_id in course_ids])
+
+    instructors = user_ids[-courses:]
+    students = user_ids[:-courses]
+    _insert(instructor_course_maps, [
+        {'user_id': user_id, 'course_id': course_id}
+        for user_id, course_id in zip(instructors, course_ids)])
+    roster = dict((course_id, []) for course_id in course_ids)
+    enrollments = []
+    for user_id in students:
+        for course_id in rng.sample(
+                course_ids, min(courses_per_student, len(course_ids))):
+            roster[course_id].append(user_id)
+            enrollments.append({'user_id': user_id, 'course_id': course_id})
+    _insert(student_course_maps, enrollments)
+
+    assignment_rows = []
+    for i in range(assignments):
+        due_at = now + datetime.timedelta(hours=rng.randint(-24 * 30, 24 * 30))
+        assignment_rows.append({
+            'id': i + 1,
+            'name': 'Assignment %d' % (i + 1),
+            'course_id': course_ids[i % courses],
+            'due_at': due_at,
+            'display_at': due_at - datetime.timedelta(days=14),
+            'description': 'Synthetic assignment',
+            'description_filename': 'assignment-%d.pdf' % (i + 1)})
+    _insert(Assignment.__table__, assignment_rows)
+
+    presentation_rows = []
+    for course_id in course_ids:
+        for j in range(presentations_per_course):
+            presentation_rows.append({
+                'course_id': course_id,
+                'name': 'Lecture %d' % (j + 1),
+                'filename': 'lecture-%d-%d.pptx' % (course_id, j + 1),
+                'created_at': now,
+                'display_at': now + datetime.timedelta(days=rng.randint(-30, 30))})
+    _insert(Presentation.__table__, presentation_rows)
+
+    # most students submit once, and the rest of the budget goes to
+    # resubmissions; each student's last submission is the official one
+    per_assignment = submissions // max(assignments, 1)
+    submission_rows = []
+    for assignment in assignment_rows:
+        enrolled = roster[assignment['course_id']]
+        if not enrolled:
+            continue
+        submitters = rng.sample(
+            enrolled, min(len(enrolled), int(per_assignment * 0.8) or 1))
+        picks = submitters + [rng.choice(submitters) for _ in
+                              range(max(per_assignment - len(submitters), 0))]
+        latest = {}
+        for n, user_id in enumerate(picks):
+            row = {
+                'user_id': user_id,
+                'assignment_id': assignment['id'],
+                'filename': 'a%d-u%d-%d.zip' % (assignment['id'], user_id, n),
+                'submitted_at': assignment['due_at'] + datetime.timedelta(
+                    minutes=rng.randint(-3 * 24 * 60, 60)),
+                'is_official': False}
+            submission_rows.append(row)
+            if user_id not in latest or \
+                    latest[user_id]['submitted_at'] <= row['submitted_at']:
+                latest[user_id] = row
+        for row in latest.values():
+            row['is_official'] = True
+    _insert(Submission.__table__, submission_rows)
+
+    sizes = _write_blobs(blobs)
+    digests = sorted(sizes)
+    refcounts = collections.Counter()
+    stored_rows = []
+    for setname, filenames in [
+            ('syllabi', ['syllabus-%04d.pdf' % course_id
+                         for course_id in course_ids]),
+            ('assignments', [row['description_filename']
+                             for row in assignment_rows]),
+            ('presentations', [row['filename'] for row in presentation_rows]),
+            ('submissions', [row['filename'] for row in submission_rows])]:
+        for filename in filenames:
+            digest = rng.choice(digests)
+            refcounts[digest] += 1
+            stored_rows.append({'setname': setname, 'filename': filename,
+                                'blob_digest': digest})
+    _insert(Blob.__table__, [
+        {'digest': digest, 'size': sizes[digest], 'refcount': refcount}
+        for digest, refcount in sorted(refcounts.items())])
+    _insert(StoredFile.__table__, stored_rows)
+
+    db.session.commit()
+    return {
+        'users': len(user_rows),
+        'courses': courses,
+        'assignments': len(assignment_rows),
+        'presentations': len(presentation_rows),
+        'submissions': len(submission_rows),
+        'stored files': len(stored_rows),
+    }
@@ -0,0 +1,59 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix='wpi-tests-')
+
+
+def _config():
+    # The app reads a `config` module when it's imported. The tests use the
+    # shipped example with a scratch SQLite database and upload directories.
+    config = types.ModuleType('config')
+    path = os.path.join(ROOT, 'config.py.example')
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), config.__dict__)
+    config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(
+        SCRATCH, 'test.db')
+    config.SQLALCHEMY_TRACK_MODIFICATIONS = False
+    uploads = os.path.join(SCRATCH, 'uploads')
+    config.UPLOADS_DEFAULT_DEST = uploads + '/'
+    config.UPLOADS_BLOB_DEST = os.path.join(uploads, 'blobs') + '/'
+    config.UPLOADS_CHUNK_DEST = os.path.join(uploads, 'chunks') + '/'
+    config.UPLOADS_INGEST_DEST = os.path.join(uploads, 'ingest') + '/'
+    config.ADMIN_USERNAMES = ['admin']
+    config.MANIFEST_WORKERS = 0
+    config.TESTING = True
+    return config
+
+
+sys.modules['config'] = _config()
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(SCRATCH, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    from wsgi import create_app
+    return create_app()
+
+
+@pytest.fixture
+def database(app):
+    # an empty schema for each test
+    from db import db
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        yield db
+        db.session.remove()
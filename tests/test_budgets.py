@@ -0,0 +1,32 @@
+import pytest
+
+import budgets
+import models
+import synthetic
+
+
+@pytest.fixture
+def synthetic_data(database, monkeypatch):
+    # users are refreshed from LDAP when they're loaded; there's none here
+    monkeypatch.setattr(models, 'ldap_fetch', lambda **kwargs: None)
+    models.user_cache.clear()
+    synthetic.build(courses=4, users=80, assignments=8, submissions=200,
+                    presentations_per_course=2, admin_usernames=['admin'],
+                    blobs=10)
+    return database
+
+
+def test_pages_stay_within_their_budgets(synthetic_data, app):
+    results = budgets.run()
+    assert set(r['role'] for r in results) == set('sia')
+    over = ['%(endpoint)s as %(role)s: %(status)s, %(queries)s queries '
+            '(budget %(budget)s), %(seconds).3fs' % r
+            for r in results if not r['ok']]
+    assert not over
+
+
+def test_fewer_courses_than_each_student_takes(database):
+    synthetic.build(courses=2, users=20, assignments=2, submissions=10,
+                    presentations_per_course=1, admin_usernames=['admin'],
+                    blobs=2, courses_per_student=3)
+    assert models.Course.query.count() == 2
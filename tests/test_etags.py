@@ -0,0 +1,91 @@
+import datetime
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from models import User, Course, Assignment, Submission, \
+    student_course_maps, instructor_course_maps
+import ingest
+import manifests
+import models
+
+
+@pytest.fixture
+def ids(database, monkeypatch):
+    monkeypatch.setattr(models, 'ldap_fetch', lambda **kwargs: None)
+    models.user_cache.clear()
+    now = datetime.datetime.now()
+    database.session.execute(User.__table__.insert(), [
+        {'id': 1, 'username': 'jsmith', 'email': 'jsmith@example.edu'},
+        {'id': 2, 'username': 'prof', 'email': 'prof@example.edu'}])
+    course = Course(name='CS 101')
+    database.session.add(course)
+    database.session.flush()
+    database.session.execute(student_course_maps.insert().values(
+        user_id=1, course_id=course.id))
+    database.session.execute(instructor_course_maps.insert().values(
+        user_id=2, course_id=course.id))
+    assignment = Assignment(
+        name='HW1', course_id=course.id,
+        display_at=now - datetime.timedelta(days=1),
+        due_at=now + datetime.timedelta(days=1))
+    database.session.add(assignment)
+    database.session.flush()
+    database.session.add(Submission(
+        filename='project.zip', is_official=True, user_id=1,
+        assignment_id=assignment.id))
+    database.session.commit()
+    return {'assignment': assignment.id, 'course': course.id}
+
+
+def client_for(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = session['_user_id'] = u'%d' % user_id
+        session['_fresh'] = True
+    return client
+
+
+def get(app, client, path, **kwargs):
+    # a fresh app context, so nothing memoized on g carries over from the
+    # previous request
+    with app.app_context():
+        return client.get(path, **kwargs)
+
+
+def etag(app, client, path):
+    response = get(app, client, path)
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def test_indexing_a_manifest_only_changes_the_assignment_page(app, ids):
+    client = client_for(app, 2)
+    assignment_page = '/assignments/%(assignment)d' % ids
+    course_page = '/courses/%(course)d' % ids
+    before = etag(app, client, assignment_page), etag(app, client, course_page)
+    assert get(app, client, assignment_page, headers={
+        'If-None-Match': before[0]}).status_code == 304
+
+    submission_id = Submission.query.one().id
+    manifests.index_submission(submission_id)
+
+    after = etag(app, client, assignment_page), etag(app, client, course_page)
+    assert after[0] != before[0]
+    assert after[1] == before[1]
+
+
+def test_a_queued_upload_changes_the_students_page(app, ids, monkeypatch):
+    monkeypatch.setitem(app.config, 'SUBMISSION_INGEST', True)
+    client = client_for(app, 1)
+    assignment_page = '/assignments/%(assignment)d' % ids
+    before = etag(app, client, assignment_page)
+
+    ingest.enqueue(User.query.get(1), Assignment.query.get(ids['assignment']),
+                   FileStorage(io.BytesIO(b'contents'), 'project.zip'))
+    queued = etag(app, client, assignment_page)
+    assert queued != before
+
+    ingest.drain()
+    assert etag(app, client, assignment_page) not in (before, queued)
@@ -0,0 +1,94 @@
+import datetime
+import io
+import os
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import FileStorage
+
+from models import User, Course, Assignment, Submission
+import ingest
+import storage
+
+
+@pytest.fixture
+def ids(database):
+    now = datetime.datetime.now()
+    database.session.execute(User.__table__.insert(), [
+        {'id': 1, 'username': 'jsmith', 'email': 'jsmith@example.edu'}])
+    course = Course(name='CS 101')
+    database.session.add(course)
+    database.session.flush()
+    assignment = Assignment(
+        name='HW1', course_id=course.id,
+        display_at=now - datetime.timedelta(days=1),
+        due_at=now + datetime.timedelta(days=1))
+    database.session.add(assignment)
+    database.session.commit()
+    return {'user': 1, 'assignment': assignment.id}
+
+
+def enqueue(ids, content):
+    return ingest.enqueue(
+        User.query.get(ids['user']), Assignment.query.get(ids['assignment']),
+        FileStorage(io.BytesIO(content), 'project.zip'))
+
+
+def test_latest_queued_upload_is_official(ids):
+    enqueue(ids, b'first')
+    receipt, received_at = enqueue(ids, b'second')
+    assert ingest.drain() == 2
+    official = Submission.query.filter_by(is_official=True).one()
+    assert official.receipt == receipt
+    assert official.submitted_at == received_at
+    assert Submission.query.count() == 2
+    assert ingest.queued() == []
+
+
+def test_assignment_deleted_during_a_batch(ids, database, monkeypatch):
+    enqueue(ids, b'contents')
+    save_file = storage.save_file
+
+    def delete_then_save(*args):
+        # the deletion commits after drain() looked, before it wrote
+        monkeypatch.setattr(storage, 'save_file', save_file)
+        database.engine.execute(Assignment.__table__.delete())
+        return save_file(*args)
+
+    monkeypatch.setattr(storage, 'save_file', delete_then_save)
+    assert ingest.drain() == 1
+    assert Submission.query.count() == 0
+    assert ingest.queued() == []
+
+
+def _failed():
+    failed = os.path.join(ingest.queue_dir(), 'failed')
+    return os.listdir(failed) if os.path.isdir(failed) else []
+
+
+def test_job_failing_on_its_own_is_set_aside(ids):
+    lost, _ = enqueue(ids, b'lost')
+    receipt, _ = enqueue(ids, b'kept')
+    # neither the spooled file nor a blob for it is left
+    job, = [job for job in ingest.queued() if job['receipt'] == lost]
+    os.remove(job['tmp'])
+    ingest.run_writer(once=True)
+    assert Submission.query.one().receipt == receipt
+    assert ingest.queued() == []
+    assert [name for name in _failed() if lost in name]
+
+
+def test_batch_failing_once_is_retried(ids, monkeypatch):
+    receipt, _ = enqueue(ids, b'contents')
+    save_file = storage.save_file
+
+    def fail_once(*args):
+        # e.g. an instructor officializing a submission at the same moment
+        monkeypatch.setattr(storage, 'save_file', save_file)
+        raise IntegrityError('INSERT', {}, Exception('uq_submission_official'))
+
+    monkeypatch.setattr(storage, 'save_file', fail_once)
+    ingest.run_writer(once=True)
+    assert Submission.query.one().receipt == receipt
+    assert ingest.queued() == []
+    assert not [name for name in _failed() if receipt in name]
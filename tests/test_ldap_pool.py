@@ -0,0 +1,153 @@
+import threading
+import time
+
+import ldap
+import pytest
+
+import config
+import utils
+
+
+ENTRY = ('uidNumber=42,dc=example,dc=edu', {
+    'gecos': ['Jane Smith'], 'uid': ['jsmith'], 'uidNumber': ['42'],
+    'gidNumber': ['100'], 'mail': ['jsmith@example.edu'],
+    'wpieduPersonUUID': ['42']})
+
+
+class FakeDirectory(object):
+    # Stands in for the server behind ldap.initialize. Every connection it
+    # hands out is recorded; `fail_searches` connections answer their first
+    # search with SERVER_DOWN, as a socket the server has dropped would.
+
+    def __init__(self):
+        self.connections = []
+        self.fail_searches = 0
+        self.fail_whoami = False
+
+    def initialize(self, uri, **kwargs):
+        conn = FakeConnection(self, uri)
+        self.connections.append(conn)
+        return conn
+
+
+class FakeConnection(object):
+
+    def __init__(self, directory, uri):
+        self.directory = directory
+        self.uri = uri
+        self.options = {}
+        self.binds = []
+        self.searches = 0
+        self.whoamis = 0
+        self.closed = False
+
+    def set_option(self, option, value):
+        self.options[option] = value
+
+    def simple_bind_s(self, dn, password):
+        self.binds.append(dn)
+
+    def search_ext_s(self, base_dn, scope, filterstr, attrs, timeout=-1,
+                     sizelimit=0):
+        self.searches += 1
+        if self.directory.fail_searches:
+            self.directory.fail_searches -= 1
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return [ENTRY]
+
+    def whoami_s(self):
+        self.whoamis += 1
+        if self.directory.fail_whoami:
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        return 'dn:' + config.BIND_DN
+
+    def unbind_s(self):
+        self.closed = True
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    directory = FakeDirectory()
+    monkeypatch.setattr(ldap, 'initialize', directory.initialize)
+    monkeypatch.setattr(ldap, 'set_option', lambda option, value: None)
+    return directory
+
+
+def use_pool(monkeypatch, size=2, timeout=1, recheck_after=60):
+    pool = utils.LDAPPool(utils._service_connection, size=size,
+                          timeout=timeout, recheck_after=recheck_after)
+    monkeypatch.setattr(utils, 'ldap_pool', pool)
+    return pool
+
+
+def test_connections_are_reused(directory, monkeypatch):
+    use_pool(monkeypatch)
+    for _ in range(5):
+        assert utils.ldap_fetch(uid=42)['uid'] == 'jsmith'
+    assert len(directory.connections) == 1
+    assert directory.connections[0].searches == 5
+    assert directory.connections[0].binds == [config.BIND_DN]
+
+
+def test_network_timeout_is_set_on_connections(directory, monkeypatch):
+    use_pool(monkeypatch)
+    utils.ldap_search('uid=jsmith')
+    assert directory.connections[0].options == {
+        ldap.OPT_NETWORK_TIMEOUT: config.LDAP_NETWORK_TIMEOUT}
+
+
+def test_server_down_is_retried_on_a_new_connection(directory, monkeypatch):
+    pool = use_pool(monkeypatch)
+    utils.ldap_search('uid=jsmith')
+    directory.fail_searches = 1
+    assert utils.ldap_fetch(uid=42)['uid'] == 'jsmith'
+    stale, fresh = directory.connections
+    assert stale.closed and not fresh.closed
+    # the stale connection no longer counts against the pool
+    assert pool._created == 1
+    assert [conn.connection for conn, _ in pool._idle] == [fresh]
+
+
+def test_server_down_twice_is_raised(directory, monkeypatch):
+    pool = use_pool(monkeypatch)
+    directory.fail_searches = 2
+    with pytest.raises(ldap.SERVER_DOWN):
+        utils.ldap_search('uid=jsmith')
+    assert pool._created == 0
+
+
+def test_idle_connections_are_checked_and_replaced(directory, monkeypatch):
+    use_pool(monkeypatch, recheck_after=0)
+    utils.ldap_search('uid=jsmith')
+    utils.ldap_search('uid=jsmith')
+    assert len(directory.connections) == 1
+    assert directory.connections[0].whoamis == 1
+
+    directory.fail_whoami = True
+    utils.ldap_search('uid=jsmith')
+    assert len(directory.connections) == 2
+    assert directory.connections[0].closed
+
+
+def test_waiting_for_a_connection_times_out(directory, monkeypatch):
+    pool = use_pool(monkeypatch, size=1, timeout=0.2)
+    held = pool.acquire()
+    start = time.time()
+    with pytest.raises(utils.LDAPPoolTimeout):
+        pool.acquire()
+    assert 0.2 <= time.time() - start < 1
+    pool.release(held)
+    assert pool.acquire() is held
+
+
+def test_a_released_connection_wakes_a_waiter(directory, monkeypatch):
+    pool = use_pool(monkeypatch, size=1, timeout=2)
+    held = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.1)
+    pool.release(held)
+    waiter.join(1)
+    assert got == [held]
+    assert len(directory.connections) == 1
@@ -0,0 +1,59 @@
+import datetime
+
+import pytest
+
+from models import User, Course, Assignment, Presentation, Submission, \
+    student_course_maps, instructor_course_maps
+
+
+@pytest.fixture
+def populated(database):
+    now = datetime.datetime.now()
+    day = datetime.timedelta(days=1)
+    database.session.execute(User.__table__.insert(), [
+        {'id': 1, 'username': 'jsmith', 'email': 'jsmith@example.edu'},
+        {'id': 2, 'username': 'prof', 'email': 'prof@example.edu'}])
+    course = Course(name='CS 101', syllabus_filename='syllabus.pdf')
+    database.session.add(course)
+    database.session.flush()
+    database.session.execute(student_course_maps.insert().values(
+        user_id=1, course_id=course.id))
+    database.session.execute(instructor_course_maps.insert().values(
+        user_id=2, course_id=course.id))
+    assignment = Assignment(
+        name='HW1', course_id=course.id, display_at=now - day,
+        due_at=now + day, description_filename='description.pdf')
+    database.session.add(assignment)
+    database.session.add(Presentation(
+        name='Lecture 1', course_id=course.id, display_at=now - day,
+        filename='lecture.pptx'))
+    database.session.flush()
+    database.session.add(Submission(
+        filename='project.zip', is_official=True, user_id=1,
+        assignment_id=assignment.id))
+    database.session.commit()
+    return database
+
+
+def test_hot_lookups_use_indexes(populated):
+    import manager
+    plans = manager.hot_lookup_plans()
+    assert plans
+    used = []
+    for statement, plan in plans:
+        # SQLite's EXPLAIN QUERY PLAN rows end with a detail string: SEARCH
+        # for an index or key lookup, SCAN for a full table scan
+        details = [row[-1] for row in plan]
+        scans = [detail for detail in details if detail.startswith('SCAN')
+                 and detail != 'SCAN CONSTANT ROW']
+        assert not scans, statement
+        used.extend(details)
+    used = '\n'.join(used)
+    for index in ['sqlite_autoindex_student_course_maps_1',
+                  'sqlite_autoindex_instructor_course_maps_1',
+                  'ix_assignment_course_due_at',
+                  'ix_assignment_course_display_at',
+                  'ix_presentation_course_display_at',
+                  'ix_submission_assignment_user',
+                  'ix_submission_filename']:
+        assert index in used
@@ -0,0 +1,90 @@
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+from models import User, Course, invalidate_catalog, user_cache
+from replica import read_replica
+import models
+
+
+@pytest.fixture
+def replica(database, app, monkeypatch, tmpdir):
+    # the primary and a copy of it, as in config.py.example; the copy still
+    # has the course's old name, so each read shows where it went
+    monkeypatch.setattr(models, 'ldap_fetch', lambda **kwargs: None)
+    database.session.execute(User.__table__.insert(), [
+        {'id': 1, 'username': 'jsmith', 'email': 'jsmith@example.edu'}])
+    database.session.add(Course(name='On the primary'))
+    database.session.commit()
+    database.session.remove()
+    path = str(tmpdir.join('replica.db'))
+    shutil.copy(database.engine.url.database, path)
+    copy = sqlite3.connect(path)
+    copy.execute("UPDATE course SET name = 'On the replica'")
+    copy.commit()
+    copy.close()
+    monkeypatch.setitem(app.config, 'SQLALCHEMY_BINDS',
+                        {'replica': 'sqlite:///' + path})
+    user_cache.clear()
+    invalidate_catalog()
+    yield path
+    database.session.remove()
+    database.get_engine(app, bind='replica').dispose()
+
+
+def course_names(db):
+    return [name for name, in db.session.query(Course.name).order_by(
+        Course.id)]
+
+
+# Each test pushes a fresh app context: the fixture's inserts marked the one
+# it runs in as written, which keeps its reads on the primary.
+
+def test_reads_go_to_the_replica_only_when_asked(replica, database, app):
+    with app.app_context(), app.test_request_context():
+        assert course_names(database) == ['On the primary']
+        with read_replica():
+            assert course_names(database) == ['On the replica']
+            # a locking read is for a write that follows it
+            assert database.session.query(Course.name).with_for_update(
+                ).scalar() == 'On the primary'
+
+
+def test_writes_and_later_reads_go_to_the_primary(replica, database, app):
+    with app.app_context(), app.test_request_context():
+        with read_replica():
+            database.session.add(Course(name='Added'))
+            database.session.flush()
+            assert course_names(database) == ['On the primary', 'Added']
+            database.session.commit()
+    primary = sqlite3.connect(database.engine.url.database)
+    copy = sqlite3.connect(replica)
+    try:
+        assert primary.execute(
+            "SELECT count(*) FROM course WHERE name = 'Added'").fetchone() \
+            == (1,)
+        assert copy.execute('SELECT count(*) FROM course').fetchone() == (1,)
+    finally:
+        primary.close()
+        copy.close()
+
+
+def test_read_only_pages_read_from_the_replica(replica, app):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = session['_user_id'] = u'1'
+        session['_fresh'] = True
+    # a fresh app context per request, so nothing on g carries over
+    with app.app_context():
+        page = client.get('/courses').get_data(as_text=True)
+    assert 'On the replica' in page
+
+    # a user who just wrote reads from the primary for a while
+    with client.session_transaction() as session:
+        session['_primary_until'] = time.time() + 60
+    invalidate_catalog()
+    with app.app_context():
+        page = client.get('/courses').get_data(as_text=True)
+    assert 'On the primary' in page
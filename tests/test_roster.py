@@ -0,0 +1,62 @@
+import pytest
+
+from models import User, Course
+import roster
+
+
+@pytest.fixture
+def course(database, monkeypatch):
+    database.session.execute(User.__table__.insert(), [
+        {'id': i, 'username': name, 'email': name + '@example.edu'}
+        for i, name in enumerate(['jsmith', 'alice', 'bob', 'carol', 'dave',
+                                  'erin', 'frank'], 1)])
+    course = Course(name='CS 101')
+    database.session.add(course)
+    database.session.commit()
+    monkeypatch.setattr(roster, 'ldap_fetch_many', lambda usernames: dict(
+        (name, {'id': str(100 + i), 'uid': name, 'mail': name + '@x'})
+        for i, name in enumerate(usernames) if name.startswith('new')))
+    return course
+
+
+def students(course):
+    return sorted(user.username for user in course.students)
+
+
+def test_usernames_match_case_insensitively(course):
+    diff = roster.sync_roster(course, ['JSmith', 'Alice', 'newbie', 'ghost'])
+    assert diff == {'added': ['Alice', 'JSmith', 'newbie'], 'removed': [],
+                    'unknown': ['ghost']}
+    assert students(course) == ['alice', 'jsmith', 'newbie']
+    assert roster.sync_roster(course, ['ALICE', 'jsmith', 'NEWBIE']) == {
+        'added': [], 'removed': [], 'unknown': []}
+
+
+def test_an_empty_roster_is_refused(course):
+    roster.sync_roster(course, ['jsmith', 'alice'])
+    with pytest.raises(roster.RosterError):
+        roster.sync_roster(course, roster.parse_usernames(['username']))
+    assert students(course) == ['alice', 'jsmith']
+
+
+def test_many_removals_need_confirming(course):
+    everyone = ['jsmith', 'alice', 'bob', 'carol', 'dave', 'erin', 'frank']
+    roster.sync_roster(course, everyone)
+    with pytest.raises(roster.RemovalsNeedConfirming) as raised:
+        roster.sync_roster(course, ['jsmith'])
+    assert raised.value.removed == sorted(everyone[1:])
+    assert len(students(course)) == 7
+
+    diff = roster.sync_roster(course, ['jsmith'], confirmed=True)
+    assert len(diff['removed']) == 6
+    assert students(course) == ['jsmith']
+
+
+def test_renamed_user_keeps_their_row(course, monkeypatch):
+    # the directory renamed jsmith (uidNumber 1) to jsmith2
+    monkeypatch.setattr(roster, 'ldap_fetch_many', lambda usernames: {
+        'jsmith2': {'id': '1', 'uid': 'jsmith2', 'mail': 'jsmith2@x'}})
+    diff = roster.sync_roster(course, ['jsmith2'])
+    assert diff['added'] == ['jsmith2']
+    assert User.query.get(1).username == 'jsmith2'
+    assert User.query.count() == 7
@@ -0,0 +1,61 @@
+import io
+import os
+
+from werkzeug.datastructures import FileStorage
+
+from models import Blob, StoredFile
+import storage
+import uploads
+
+
+def upload(name, content=b'contents'):
+    return FileStorage(stream=io.BytesIO(content), filename=name)
+
+
+def test_same_name_gets_a_suffixed_name(database):
+    first = storage.save(uploads.submissions, upload('project.zip'))
+    second = storage.save(uploads.submissions, upload('project.zip'))
+    database.session.commit()
+    assert first == 'project.zip'
+    assert second != first
+    assert second.startswith('project_') and second.endswith('.zip')
+    # both names share the one blob
+    assert Blob.query.one().refcount == 2
+
+
+def test_name_taken_concurrently_is_retried(database, monkeypatch):
+    storage.save(uploads.submissions, upload('project.zip'))
+    # another upload took the name after this one looked
+    monkeypatch.setattr(storage, '_free_name', lambda setname, name: name)
+    filename = storage.save(uploads.submissions, upload('project.zip'))
+    database.session.commit()
+    assert filename != 'project.zip'
+    assert StoredFile.query.count() == 2
+
+
+def test_collected_blob_is_stored_again(database):
+    storage.save(uploads.submissions, upload('a.zip'))
+    database.session.commit()
+    storage.release('submissions', 'a.zip')
+    database.session.commit()
+    storage.collect_garbage()
+    assert Blob.query.count() == 0
+
+    filename = storage.save(uploads.submissions, upload('b.zip'))
+    database.session.commit()
+    blob = Blob.query.one()
+    assert blob.refcount == 1
+    path = storage.path_for('submissions', filename)
+    with open(path, 'rb') as f:
+        assert f.read() == b'contents'
+
+
+def test_reused_blob_with_missing_file_is_restored(database):
+    filename = storage.save(uploads.submissions, upload('a.zip'))
+    database.session.commit()
+    path = storage.path_for('submissions', filename)
+    os.remove(path)
+    storage.save(uploads.submissions, upload('b.zip'))
+    database.session.commit()
+    assert Blob.query.one().refcount == 2
+    assert os.path.exists(path)
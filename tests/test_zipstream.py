@@ -0,0 +1,50 @@
+import io
+import zipfile
+
+import pytest
+
+import zipstream
+
+
+@pytest.fixture
+def entries(tmpdir):
+    found = []
+    for i, content in enumerate([b'first file', b'', b'x' * 100000]):
+        path = tmpdir.join('%d.zip' % i)
+        path.write(content, mode='wb')
+        found.append((u'student-%d/project.zip' % i, str(path), 1000000000))
+    return found
+
+
+def unzipped(entries):
+    archive = zipfile.ZipFile(io.BytesIO(
+        b''.join(zipstream.zip_stream(entries))))
+    assert archive.testzip() is None
+    return dict((info.filename, archive.read(info))
+                for info in archive.infolist())
+
+
+def expected(entries):
+    found = {}
+    for name, path, mtime in entries:
+        with open(path, 'rb') as f:
+            found[name] = f.read()
+    return found
+
+
+def test_archive_unzips(entries):
+    assert unzipped(entries) == expected(entries)
+
+
+def test_large_entries_and_offsets_use_zip64(entries, monkeypatch):
+    # every entry but the empty one is "large", and all but the first start
+    # past the limit, as they would in an archive of several GiB
+    monkeypatch.setattr(zipstream, 'ZIP64_LIMIT', 5)
+    data = b''.join(zipstream.zip_stream(entries))
+    assert b'PK\x06\x06' in data and b'PK\x06\x07' in data
+    assert unzipped(entries) == expected(entries)
+
+
+def test_many_entries_use_zip64(entries, monkeypatch):
+    monkeypatch.setattr(zipstream, 'ZIP64_COUNT_LIMIT', 2)
+    assert unzipped(entries) == expected(entries)
@@ -1,14 +1,91 @@
+import mimetypes
+import os
+import posixpath
+
+from flask import request, send_file, abort, Response
+from werkzeug.datastructures import ContentRange
+
 from db import app
-from flask.ext.uploads import UploadSet, configure_uploads, ARCHIVES, DOCUMENTS
+from flask.ext.uploads import UploadSet, ARCHIVES, DOCUMENTS
 
 PRESENTATIONS = ('ppt', 'pptx', 'odp')
 PDF = ('pdf',)
 
-print(app.config)
-
 submissions = UploadSet('submissions', ARCHIVES)
 presentations = UploadSet('presentations', PRESENTATIONS)
 syllabi = UploadSet('syllabi', PDF)
 assignment_descs = UploadSet('assignments', DOCUMENTS + PDF)
 
-configure_uploads(app, (submissions, presentations, syllabi, assignment_descs))
+UPLOAD_SETS = (submissions, presentations, syllabi, assignment_descs)
+
+
+def _guess_mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _read_range(path, start, stop, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def _if_range_matches(response):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    etag = response.headers.get('ETag')
+    return if_range in (etag, response.headers.get('Last-Modified'))
+
+
+def send_upload(filename, path):
+    if not os.path.isfile(path):
+        abort(404)
+
+    # let the front-end proxy do the transfer once permission is granted
+    mode = app.config.get('UPLOADS_SENDFILE')
+    if mode == 'x-accel-redirect':
+        response = Response(mimetype=_guess_mimetype(filename))
+        # the internal location maps onto UPLOADS_DEFAULT_DEST
+        relpath = os.path.relpath(path, app.config['UPLOADS_DEFAULT_DEST'])
+        response.headers['X-Accel-Redirect'] = posixpath.join(
+            app.config['UPLOADS_ACCEL_REDIRECT_PREFIX'], relpath)
+        return response
+    elif mode == 'x-sendfile':
+        response = Response(mimetype=_guess_mimetype(filename))
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+        return response
+
+    response = send_file(
+        path, mimetype=_guess_mimetype(filename), conditional=True)
+    response.accept_ranges = 'bytes'
+    if response.status_code != 200 or request.range is None:
+        return response
+    if request.range.units != 'bytes' or len(request.range.ranges) != 1:
+        return response
+    if not _if_range_matches(response):
+        return response
+
+    length = os.path.getsize(path)
+    byte_range = request.range.range_for_length(length)
+    response.close()
+    if byte_range is None:
+        partial = Response(status=416)
+        partial.content_range = ContentRange('bytes', None, None, length)
+        return partial
+    start, stop = byte_range
+    partial = Response(
+        _read_range(path, start, stop), status=206,
+        mimetype=response.mimetype, direct_passthrough=True)
+    for header in ('ETag', 'Last-Modified', 'Cache-Control', 'Expires'):
+        if header in response.headers:
+            partial.headers[header] = response.headers[header]
+    partial.accept_ranges = 'bytes'
+    partial.content_length = stop - start
+    partial.content_range = ContentRange('bytes', start, stop, length)
+    return partial
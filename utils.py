@@ -1,7 +1,142 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 from flask import g, redirect, url_for
+import ldap
+import ldap.filter
 import simpleldap
 
 import config
+import metrics
+
+
+class LDAPPoolTimeout(Exception):
+    pass
+
+
+class LDAPPool(object):
+
+    def __init__(self, connect, size, timeout, recheck_after):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.recheck_after = recheck_after
+        self._cond = threading.Condition()
+        self._reset()
+
+    def _reset(self):
+        # sockets inherited from a parent process can't be shared
+        self._pid = os.getpid()
+        self._idle = []
+        self._created = 0
+
+    def _open(self):
+        with metrics.timed('ldap_bind_seconds'):
+            return self.connect()
+
+    def _healthy(self, conn, idle_since):
+        if time.time() - idle_since < self.recheck_after:
+            return True
+        try:
+            conn.connection.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except ldap.LDAPError:
+            pass
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def acquire(self):
+        start = time.time()
+        idle = None
+        with self._cond:
+            if self._pid != os.getpid():
+                self._reset()
+            while not self._idle and self._created >= self.size:
+                remaining = self.timeout - (time.time() - start)
+                if remaining <= 0:
+                    metrics.incr('ldap_pool_timeouts')
+                    raise LDAPPoolTimeout()
+                self._cond.wait(remaining)
+            if self._idle:
+                idle = self._idle.pop()
+            else:
+                self._created += 1
+        metrics.observe('ldap_pool_wait_seconds', time.time() - start)
+
+        if idle is not None:
+            conn, idle_since = idle
+            if self._healthy(conn, idle_since):
+                return conn
+            metrics.incr('ldap_pool_reconnects')
+            self._close(conn)
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except ldap.LDAPError:
+            self._discard(conn)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+
+def _service_connection():
+    return simpleldap.Connection(
+        config.LDAP_SERVER,
+        port=config.LDAP_PORT,
+        require_cert=False,
+        dn=config.BIND_DN, password=config.LDAP_PASSWORD,
+        encryption='ssl',
+        options={'OPT_NETWORK_TIMEOUT': config.LDAP_NETWORK_TIMEOUT})
+
+
+ldap_pool = LDAPPool(
+    _service_connection,
+    size=config.LDAP_POOL_SIZE,
+    timeout=config.LDAP_POOL_TIMEOUT,
+    recheck_after=config.LDAP_POOL_RECHECK)
+
+
+def ldap_search(filterstr):
+    with metrics.timed('ldap_search_seconds'):
+        try:
+            with ldap_pool.connection() as conn:
+                return conn.search(filterstr, base_dn=config.BASE_DN)
+        except ldap.SERVER_DOWN:
+            # the pooled connection went stale; retry once on a fresh one
+            with ldap_pool.connection() as conn:
+                return conn.search(filterstr, base_dn=config.BASE_DN)
 
 
 def ldap_fetch(uid=None, name=None, passwd=None):
@@ -9,37 +144,55 @@ def ldap_fetch(uid=None, name=None, passwd=None):
     result = None
     if name is not None and passwd is not None:
         # weird hack to auth with WPI CCC
-        conn = simpleldap.Connection(
-            config.LDAP_SERVER,
-            port=config.LDAP_PORT,
-            require_cert=False,
-            dn=config.BIND_DN, password=config.LDAP_PASSWORD,
-            encryption='ssl')
-        res = conn.search('uid={0}'.format(name), base_dn=config.BASE_DN)
+        res = ldap_search('uid={0}'.format(name))
+        if not res:
+            return None
         dn = config.BIND_DN_FORMAT.format(res[0]['wpieduPersonUUID'][0])
         try:
-            conn2 = simpleldap.Connection(
-                config.LDAP_SERVER,
-                port=config.LDAP_PORT,
-                require_cert=False,
-                dn=dn, password=passwd,
-                encryption='ssl')
-            result = conn.search('uid={0}'.format(name), base_dn=config.BASE_DN)
+            with metrics.timed('ldap_bind_seconds'):
+                conn2 = simpleldap.Connection(
+                    config.LDAP_SERVER,
+                    port=config.LDAP_PORT,
+                    require_cert=False,
+                    dn=dn, password=passwd,
+                    encryption='ssl')
+            conn2.close()
+            result = res
         except:
             return None
     else:
-        conn = simpleldap.Connection(config.LDAP_SERVER)
-        result = conn.search(
-            'uidNumber={0}'.format(uid),
-            base_dn=config.BASE_DN)
+        result = ldap_search('uidNumber={0}'.format(uid))
 
     if result:
-        return {
-            'name': result[0]['gecos'][0].split(' ')[0],
-            'uid': result[0]['uid'][0],
-            'id': unicode(result[0]['uidNumber'][0]),
-            'gid': int(result[0]['gidNumber'][0]),
-            'mail': result[0]['mail'][0]
-        }
+        return _parse_entry(result[0])
     else:
         return None
+
+
+def _parse_entry(entry):
+    return {
+        'name': entry['gecos'][0].split(' ')[0],
+        'uid': entry['uid'][0],
+        'id': unicode(entry['uidNumber'][0]),
+        'gid': int(entry['gidNumber'][0]),
+        'mail': entry['mail'][0]
+    }
+
+
+def chunks(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def ldap_fetch_many(usernames, batch_size=100):
+    # one OR-filter search per batch instead of a search per user
+    found = {}
+    for batch in chunks(usernames, batch_size):
+        filterstr = '(|%s)' % ''.join(
+            '(uid=%s)' % ldap.filter.escape_filter_chars(name)
+            for name in batch)
+        for entry in ldap_search(filterstr):
+            parsed = _parse_entry(entry)
+            found[parsed['uid']] = parsed
+    return found
@@ -0,0 +1,39 @@
+from flask.ext.uploads import configure_uploads
+
+from db import app
+from uploads import UPLOAD_SETS
+import instrumentation
+import replica
+
+
+# Entry point for a preforking WSGI server, e.g.
+#
+#   gunicorn -c gunicorn.conf.py wsgi:application
+#
+# Everything that wires extensions into the app happens in create_app rather
+# than at import, so it runs once per process no matter how many modules
+# import the app. It isn't a factory: the views and models are bound to the
+# one app in db.py, which create_app configures on its first call and
+# returns on every call.
+
+_configured = False
+
+
+def create_app():
+    global _configured
+    if not _configured:
+        import server  # registers the views
+        server.login_manager.init_app(app)
+        instrumentation.init_app(app)
+        replica.init_app(app)
+        configure_uploads(app, UPLOAD_SETS)
+        _configured = True
+    return app
+
+
+application = create_app()
+
+
+if __name__ == '__main__':
+    # development server only
+    application.run('0.0.0.0', debug=True, ssl_context='adhoc')
@@ -0,0 +1,120 @@
+import os
+import struct
+import time
+import zlib
+
+
+# Writes a zip archive as a stream of byte strings without seeking, so it can
+# be sent while it is being built. Entries are stored uncompressed (the inputs
+# are archives already) and each one's CRC and sizes follow its data in a data
+# descriptor. Entries of ZIP64_LIMIT bytes or more, entries that start past
+# it and archives with too many entries or too large a central directory get
+# Zip64 records, which every current unzip tool reads.
+
+READ_SIZE = 64 * 1024
+ZIP64_LIMIT = 0xffffffff
+ZIP64_COUNT_LIMIT = 0xffff
+ZIP64_VERSION = 45
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _zip64_extra(*values):
+    return struct.pack('<HH', 0x0001, 8 * len(values)) + b''.join(
+        struct.pack('<Q', value) for value in values)
+
+
+def _central_record(name, flags, dos_time, dos_date, crc, size, start):
+    extra = []
+    if size >= ZIP64_LIMIT:
+        extra.extend([size, size])
+        size = 0xffffffff
+    if start >= ZIP64_LIMIT:
+        extra.append(start)
+        start = 0xffffffff
+    extra = _zip64_extra(*extra) if extra else b''
+    version = ZIP64_VERSION if extra else 20
+    return struct.pack(
+        '<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, flags, 0,
+        dos_time, dos_date, crc, size, size, len(name), len(extra), 0, 0, 0,
+        0o100644 << 16, start) + name + extra
+
+
+def _end_records(count, central_start, central_size):
+    records = b''
+    if (count >= ZIP64_COUNT_LIMIT or central_start >= ZIP64_LIMIT or
+            central_size >= ZIP64_LIMIT):
+        end64 = central_start + central_size
+        records += struct.pack(
+            '<IQHHIIQQQQ', 0x06064b50, 44, ZIP64_VERSION, ZIP64_VERSION, 0,
+            0, count, count, central_size, central_start)
+        records += struct.pack('<IIQI', 0x07064b50, 0, end64, 1)
+        count = min(count, 0xffff)
+        central_start = min(central_start, 0xffffffff)
+        central_size = min(central_size, 0xffffffff)
+    return records + struct.pack(
+        '<IHHHHIIH', 0x06054b50, 0, 0, count, count, central_size,
+        central_start, 0)
+
+
+# `entries` is an iterable of (archive name, path on disk, mtime) tuples
+def zip_stream(entries):
+    offset = 0
+    central = []
+    for name, path, mtime in entries:
+        if isinstance(name, bytes):
+            name = name.decode('utf-8')
+        name = name.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(mtime)
+        # bit 3: sizes follow in a data descriptor; bit 11: utf-8 names
+        flags = 0x08 | 0x800
+        # uploads don't change once stored, so the size on disk decides
+        # whether the local header needs Zip64 sizes up front
+        zip64 = os.path.getsize(path) >= ZIP64_LIMIT
+        if zip64:
+            extra = _zip64_extra(0, 0)
+            header = struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, ZIP64_VERSION, flags, 0,
+                dos_time, dos_date, 0, 0xffffffff, 0xffffffff, len(name),
+                len(extra)) + name + extra
+        else:
+            header = struct.pack(
+                '<IHHHHHIIIHH', 0x04034b50, 20, flags, 0, dos_time, dos_date,
+                0, 0, 0, len(name), 0) + name
+        yield header
+        start = offset
+        offset += len(header)
+
+        crc = 0
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(READ_SIZE)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                size += len(data)
+                yield data
+        crc &= 0xffffffff
+        offset += size
+        if zip64:
+            descriptor = struct.pack('<IIQQ', 0x08074b50, crc, size, size)
+        elif size < ZIP64_LIMIT:
+            descriptor = struct.pack('<IIII', 0x08074b50, crc, size, size)
+        else:
+            raise ValueError('%s grew while it was being zipped' % path)
+        yield descriptor
+        offset += len(descriptor)
+        central.append((name, flags, dos_time, dos_date, crc, size, start))
+
+    central_start = offset
+    for entry in central:
+        record = _central_record(*entry)
+        yield record
+        offset += len(record)
+    yield _end_records(len(central), central_start, offset - central_start)